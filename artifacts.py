@@ -0,0 +1,142 @@
+"""
+Versioned store of trained models and their preprocessing state.
+
+Every save of a named model creates a new numbered version directory holding
+the model and its preprocessor as uncompressed joblib files, next to a
+meta.json with the feature list, the metrics and any extra metadata:
+
+    .artifacts/best_clf/0001/model.joblib
+                             preprocessor.joblib
+                             meta.json
+
+Loading memory-maps the numpy arrays of the joblib files, so workers loading
+the same version share the pages of the page cache.
+"""
+
+import collections
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+import joblib
+import sklearn
+
+
+# Default location of the store
+DEFAULT_STORE_DIR = ".artifacts"
+
+Artifact = collections.namedtuple('Artifact',
+    ['name', 'version', 'model', 'preprocessor', 'features', 'metrics', 'metadata'])
+
+
+class ArtifactStore(object):
+    """
+    Versioned artifacts under one root directory
+
+    inputs:
+      - root: the directory holding one sub-directory per model name
+    """
+
+    def __init__(self, root = DEFAULT_STORE_DIR):
+        self.root = root
+
+    def _directory(self, name, version):
+        return os.path.join(self.root, name, "{:04d}".format(version))
+
+    def versions(self, name):
+        """
+        Sorted versions saved under 'name'
+        """
+
+        try:
+            entries = os.listdir(os.path.join(self.root, name))
+        except OSError:
+            return []
+        return sorted(int(entry) for entry in entries if entry.isdigit())
+
+    def save(self, name, model, preprocessor = None, features = None, metrics = None,
+             **metadata):
+        """
+        Save a new version of a model and return its version number
+
+        inputs:
+          - name: the model name, e.g. 'best_clf'
+          - model: the fitted model
+          - preprocessor: the fitted preprocessing applied before the model
+          - features: the names of the columns the model was trained on
+          - metrics: a {metric: value} dict
+          - metadata: any other JSON-serialisable values to keep with the model
+        """
+
+        os.makedirs(os.path.join(self.root, name), exist_ok = True)
+        scratch = tempfile.mkdtemp(dir = os.path.join(self.root, name))
+        try:
+            # Uncompressed, so that the arrays can be memory-mapped back
+            joblib.dump(model, os.path.join(scratch, 'model.joblib'))
+            if preprocessor is not None:
+                joblib.dump(preprocessor, os.path.join(scratch, 'preprocessor.joblib'))
+            meta = {
+                'name': name,
+                'model_class': model.__class__.__name__,
+                'features': None if features is None else [str(f) for f in features],
+                'metrics': {k: float(v) for k, v in (metrics or {}).items()},
+                'metadata': metadata,
+                'created': datetime.datetime.now().isoformat(),
+                'sklearn_version': sklearn.__version__,
+            }
+            with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent = 2)
+
+            # Claim the next free version; retry if a concurrent save took it
+            while True:
+                version = (self.versions(name) or [0])[-1] + 1
+                try:
+                    os.rename(scratch, self._directory(name, version))
+                    return version
+                except OSError:
+                    if not os.path.isdir(self._directory(name, version)):
+                        raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors = True)
+
+    def metadata(self, name, version = None):
+        """
+        The meta.json content of a version, the latest one by default
+        """
+
+        version = version or self.latest(name)
+        with open(os.path.join(self._directory(name, version), 'meta.json')) as f:
+            return json.load(f)
+
+    def latest(self, name):
+        """
+        The latest version saved under 'name'
+        """
+
+        versions = self.versions(name)
+        if not versions:
+            raise KeyError("No artifact named '{}' in {}.".format(name, self.root))
+        return versions[-1]
+
+    def load(self, name, version = None, mmap = True):
+        """
+        Load a version of a model, the latest one by default, as an Artifact
+
+        With 'mmap' set, the numpy arrays are memory-mapped read-only from the
+        store instead of being read into private memory.
+        """
+
+        version = version or self.latest(name)
+        directory = self._directory(name, version)
+        mmap_mode = 'r' if mmap else None
+        meta = self.metadata(name, version)
+
+        model = joblib.load(os.path.join(directory, 'model.joblib'), mmap_mode = mmap_mode)
+        preprocessor = None
+        if os.path.exists(os.path.join(directory, 'preprocessor.joblib')):
+            preprocessor = joblib.load(os.path.join(directory, 'preprocessor.joblib'),
+                                       mmap_mode = mmap_mode)
+        return Artifact(name, version, model, preprocessor, meta['features'], meta['metrics'],
+                        meta['metadata'])
@@ -0,0 +1,368 @@
+"""
+Benchmarks of the finding_donors preprocessing and training pipeline.
+
+Synthetic census-shaped files of any size are generated once per size and
+seed, then every stage of the pipeline as finding_donors.py runs it (load,
+CensusPreprocessor fit and transform, feature cache build and load, split,
+SGDClassifier fit and predict, the default successive-halving search) is run
+'warmup' times untimed and 'repeats' times timed, each stage consuming the
+output of the previous one. The summaries are saved as JSON and can be
+compared against a baseline file:
+
+    python bench.py --sizes 45222 1000000 --output bench.json
+    python bench.py --sizes 45222 1000000 --baseline bench.json --output new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+from time import perf_counter_ns
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import train_test_split
+
+import cache
+import census
+from finding_donors import PARAMETERS, SPLIT_SEED, TEST_SIZE, fbeta_scorer
+from preprocessing import CensusPreprocessor
+from training import take_rows
+from tuning import SuccessiveHalvingSearch
+
+
+# Rows of the modified census dataset
+CENSUS_ROWS = 45222
+
+# Default location of the generated files
+DEFAULT_BENCH_DIR = ".bench"
+
+# Stages in pipeline order
+STAGES = ['load', 'preprocessor_fit', 'transform', 'cache_build', 'cache_load', 'split', 'fit',
+          'predict', 'search']
+
+# Slowdown of the fastest run over the baseline median reported as a regression
+DEFAULT_TOLERANCE = 0.10
+
+# Education levels by their 'education-num', which the generator keeps consistent
+EDUCATION_ORDER = ['Preschool', '1st-4th', '5th-6th', '7th-8th', '9th', '10th', '11th', '12th',
+                   'HS-grad', 'Some-college', 'Assoc-voc', 'Assoc-acdm', 'Bachelors', 'Masters',
+                   'Prof-school', 'Doctorate']
+
+
+def synthetic_census(n_rows, random_state = 0):
+    """
+    A census-shaped DataFrame of 'n_rows' random records, typed as census.load_census'
+
+    The categories follow skewed random frequencies, capital-gain and
+    capital-loss are zero for most rows, and the income depends on the
+    education, age, marital status and capital gain, so that the learners
+    have something to fit.
+    """
+
+    rng = np.random.RandomState(random_state)
+    data = {}
+    for name, values in census.CATEGORIES.items():
+        weights = rng.zipf(1.5, len(values)).astype(np.float64)
+        codes = rng.choice(len(values), n_rows, p = weights / weights.sum())
+        data[name] = pd.Categorical.from_codes(codes, dtype = census.DTYPES[name])
+
+    education = rng.randint(1, 17, n_rows)
+    data['education_level'] = pd.Categorical(np.take(EDUCATION_ORDER, education - 1),
+                                             dtype = census.DTYPES['education_level'])
+    data['education-num'] = education.astype(np.int16)
+    data['age'] = np.clip(rng.normal(38, 13, n_rows), 17, 90).astype(np.int16)
+    data['hours-per-week'] = np.clip(rng.normal(40, 12, n_rows), 1, 99).astype(np.int16)
+    data['capital-gain'] = np.where(rng.rand(n_rows) < 0.08,
+                                    rng.lognormal(8, 1.2, n_rows).clip(0, 99999), 0).astype(np.float32)
+    data['capital-loss'] = np.where(rng.rand(n_rows) < 0.05,
+                                    rng.normal(1900, 400, n_rows).clip(0, 4356), 0).astype(np.float32)
+
+    married = np.asarray(data['marital-status']) == 'Married-civ-spouse'
+    logit = (0.35 * (education - 10) + 0.04 * (data['age'] - 38) + 1.5 * married
+             + np.log1p(data['capital-gain']) / 4 - 1.6 + rng.logistic(size = n_rows))
+    data[census.TARGET] = pd.Categorical.from_codes((logit > 0).astype(np.int8),
+                                                    dtype = census.DTYPES[census.TARGET])
+
+    columns = ['age', 'workclass', 'education_level', 'education-num', 'marital-status',
+               'occupation', 'relationship', 'race', 'sex', 'capital-gain', 'capital-loss',
+               'hours-per-week', 'native-country', census.TARGET]
+    return pd.DataFrame(data, columns = columns)
+
+
+def write_synthetic_census(path, n_rows, random_state = 0, chunksize = census.DEFAULT_CHUNKSIZE):
+    """
+    Write 'n_rows' synthetic records as a census CSV, one chunk at a time
+
+    Every chunk has its own seed derived from 'random_state', so the file of
+    a given size and seed is always the same.
+    """
+
+    scratch = path + '.tmp'
+    with open(scratch, 'w') as f:
+        for i, start in enumerate(range(0, n_rows, chunksize)):
+            chunk = synthetic_census(min(chunksize, n_rows - start), [random_state, i])
+            chunk.to_csv(f, header = i == 0, index = False, float_format = '%.1f')
+    os.replace(scratch, path)
+    return path
+
+
+def synthetic_path(directory, n_rows, random_state = 0):
+    """
+    Path of the synthetic file of a size and seed, generated if missing
+    """
+
+    os.makedirs(directory, exist_ok = True)
+    path = os.path.join(directory, "census_{}_{}.csv".format(n_rows, random_state))
+    if not os.path.exists(path):
+        write_synthetic_census(path, n_rows, random_state)
+    return path
+
+
+def summarize(samples_ns, rows = None):
+    """
+    Statistical summary of the timings of one stage, in seconds
+    """
+
+    samples = np.asarray(samples_ns, dtype = np.float64) / 1e9
+    p25, median, p75 = np.percentile(samples, [25, 50, 75])
+    summary = {
+        'repeats': len(samples),
+        'min': samples.min(),
+        'median': median,
+        'mean': samples.mean(),
+        'std': samples.std(ddof = 1) if len(samples) > 1 else 0.0,
+        'iqr': p75 - p25,
+        'max': samples.max(),
+        'samples': samples.tolist(),
+    }
+    if rows:
+        summary['rows'] = rows
+        summary['rows_per_second'] = rows / median if median > 0 else None
+    return summary
+
+
+def _stages(path, chunksize, search_rows, n_jobs, directory):
+    """
+    The {name: function of the pipeline state} dict of the stages, and the
+    function of (state, name) counting the rows a stage processed
+    """
+
+    def load(state):
+        return census.split_features(census.load_census(path, chunksize))
+
+    def preprocessor_fit(state):
+        features_raw, income = state['load']
+        return CensusPreprocessor(census.SKEWED, census.NUMERICAL, None,
+                                  census.CATEGORIES).fit(features_raw)
+
+    def transform(state):
+        features_raw, income = state['load']
+        return state['preprocessor_fit'].transform(features_raw)
+
+    def cache_build(state):
+        # A cold build every run: the whole file is hashed, read twice and encoded
+        shutil.rmtree(directory, ignore_errors = True)
+        cache.load_features(path, directory, chunksize = chunksize)
+        return directory
+
+    def cache_load(state):
+        return cache.load_features(path, state['cache_build'], chunksize = chunksize)
+
+    def split(state):
+        features, income, preprocessor = state['cache_load']
+        train, test = train_test_split(np.arange(len(income)), test_size = TEST_SIZE,
+                                       random_state = SPLIT_SEED)
+        return (take_rows(features, train), take_rows(features, test),
+                take_rows(income, train), take_rows(income, test))
+
+    def fit(state):
+        X_train, X_test, y_train, y_test = state['split']
+        return SGDClassifier(random_state = 1).fit(X_train, y_train)
+
+    def predict(state):
+        X_train, X_test, y_train, y_test = state['split']
+        return state['fit'].predict(X_test)
+
+    def search(state):
+        X_train, X_test, y_train, y_test = state['split']
+        search = SuccessiveHalvingSearch(SGDClassifier(random_state = 1), PARAMETERS,
+                                         fbeta_scorer(), n_jobs = n_jobs)
+        return search.fit(X_train[:search_rows], y_train[:search_rows])
+
+    def rows(state, name):
+        X_train, X_test, y_train, y_test = state.get('split', (None,) * 4)
+        if name == 'fit':
+            return len(y_train)
+        if name == 'predict':
+            return len(y_test)
+        if name == 'search':
+            return min(len(y_train), search_rows)
+        return len(state['load'][1])
+
+    functions = {'load': load, 'preprocessor_fit': preprocessor_fit, 'transform': transform,
+                 'cache_build': cache_build, 'cache_load': cache_load, 'split': split,
+                 'fit': fit, 'predict': predict, 'search': search}
+    return functions, rows
+
+
+def run_stages(path, stages = STAGES, repeats = 5, warmup = 1,
+               chunksize = census.DEFAULT_CHUNKSIZE, search_rows = CENSUS_ROWS, n_jobs = None):
+    """
+    Time the pipeline stages on one census file
+
+    The stages run in pipeline order, each one 'warmup' times untimed then
+    'repeats' times timed; the output of its last run feeds the next stages.
+    The stages a requested stage depends on run once untimed if not requested.
+
+    inputs:
+      - path: the census CSV file
+      - stages: the names of the stages to time, from STAGES
+      - repeats: the number of timed runs per stage
+      - warmup: the number of untimed runs per stage
+      - chunksize: the number of rows per chunk of the load and of the cache build
+      - search_rows: the number of training rows of the search
+      - n_jobs: the number of workers of the search, -1 for all cores
+
+    returns the {stage: summary} dict of the timed stages
+    """
+
+    directory = os.path.splitext(path)[0] + '_features'
+    functions, rows = _stages(path, chunksize, search_rows, n_jobs, directory)
+    last = max(STAGES.index(name) for name in stages)
+    state, summaries = {}, {}
+    for name in STAGES[:last + 1]:
+        if name not in stages:
+            state[name] = functions[name](state)
+            continue
+        for _ in range(warmup):
+            functions[name](state)
+        samples = []
+        for _ in range(repeats):
+            start = perf_counter_ns()
+            output = functions[name](state)
+            samples.append(perf_counter_ns() - start)
+        state[name] = output
+        summaries[name] = summarize(samples, rows(state, name))
+        print("{:>8} rows  {:<16} median {:.4f}s".format(len(state['load'][1]), name,
+                                                          summaries[name]['median']))
+    return summaries
+
+
+def environment():
+    """
+    The versions and machine the benchmarks ran on
+    """
+
+    return {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmarks(sizes = (CENSUS_ROWS,), stages = STAGES, repeats = 5, warmup = 1,
+                   directory = DEFAULT_BENCH_DIR, random_state = 0, **options):
+    """
+    Run the stage benchmarks on synthetic census files of every size
+
+    'options' are passed to run_stages. Returns the dict saved by save_results,
+    with the 'environment', the 'settings' and the {size: {stage: summary}} 'results'.
+    """
+
+    results = {}
+    for n_rows in sizes:
+        path = synthetic_path(directory, n_rows, random_state)
+        results[str(n_rows)] = run_stages(path, stages, repeats, warmup, **options)
+    settings = dict(options, sizes = list(sizes), stages = list(stages), repeats = repeats,
+                    warmup = warmup, random_state = random_state)
+    return {'environment': environment(), 'settings': settings, 'results': results}
+
+
+def save_results(report, path):
+    """
+    Save a benchmark report as sorted, indented JSON, so that two reports diff cleanly
+    """
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent = 2, sort_keys = True)
+        f.write('\n')
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance = DEFAULT_TOLERANCE):
+    """
+    Compare the stage timings of a report with those of a baseline report
+
+    A stage regressed when even its fastest run is more than 'tolerance'
+    slower than the baseline median, which keeps one noisy run from being
+    reported. Returns one dict per (size, stage) in both reports, with the
+    two medians, their 'ratio' and the 'regression' flag.
+    """
+
+    rows = []
+    for size, stages in sorted(report['results'].items(), key = lambda item: int(item[0])):
+        for stage, summary in stages.items():
+            reference = baseline['results'].get(size, {}).get(stage)
+            if reference is None:
+                continue
+            rows.append({
+                'size': int(size),
+                'stage': stage,
+                'baseline': reference['median'],
+                'current': summary['median'],
+                'ratio': summary['median'] / reference['median'],
+                'regression': summary['min'] > reference['median'] * (1 + tolerance),
+            })
+    return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the finding_donors pipeline.")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [CENSUS_ROWS],
+                        help = "rows of the synthetic census files")
+    parser.add_argument('--stages', nargs = '+', choices = STAGES, default = STAGES)
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--warmup', type = int, default = 1)
+    parser.add_argument('--seed', type = int, default = 0, help = "seed of the synthetic data")
+    parser.add_argument('--chunksize', type = int, default = census.DEFAULT_CHUNKSIZE)
+    parser.add_argument('--search-rows', type = int, default = CENSUS_ROWS,
+                        help = "training rows of the search")
+    parser.add_argument('--n-jobs', type = int, default = None)
+    parser.add_argument('--directory', default = DEFAULT_BENCH_DIR,
+                        help = "directory of the generated files")
+    parser.add_argument('--output', default = 'bench.json')
+    parser.add_argument('--baseline', default = None, help = "report to compare against")
+    parser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.stages, args.repeats, args.warmup, args.directory,
+                            args.seed, chunksize = args.chunksize,
+                            search_rows = args.search_rows, n_jobs = args.n_jobs)
+    save_results(report, args.output)
+    if args.baseline is None:
+        return 0
+
+    rows = compare(report, load_results(args.baseline), args.tolerance)
+    for row in rows:
+        print("{size:>10} {stage:<16} {baseline:10.4f}s -> {current:10.4f}s  x{ratio:.2f}{flag}"
+              .format(flag = "  REGRESSION" if row['regression'] else "", **row))
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Histogram gradient boosting on quantile-binned census features.
+
+A QuantileBinner turns the encoded feature matrix of CensusPreprocessor into
+one uint8 code per census field: the bin of each numerical column, from
+quantile thresholds computed once on the training set, and the category code
+of each one-hot block. Its 13 uint8 columns take 32 times less memory than
+the 103 float32 one-hot columns, and it is built once and shared by every
+training sample size and tuning fold.
+
+HistGradientBoostingClassifier fits on those codes: the categorical fields
+are native categories instead of 98 dummy columns, and binning the codes,
+which have at most 'max_bins' distinct values per column, is cheap.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.ensemble import HistGradientBoostingClassifier
+
+
+# Bins per numerical column, and the most categories a field may have (one
+# code is kept for the categories unknown to the preprocessor)
+MAX_BINS = 255
+
+# Rows drawn to compute the quantile thresholds
+SUBSAMPLE = 200000
+
+# Rows binned at a time, to bound the memory of the float copies
+CHUNK_ROWS = 65536
+
+
+class QuantileBinner(BaseEstimator, TransformerMixin):
+    """
+    Bin codes of the numerical columns and category codes of the one-hot blocks
+
+    The output has one uint8 column per numerical column, then one per
+    one-hot block. Numerical values are mapped to the quantile bin they fall
+    in; a one-hot block is mapped to the index of its set column, or to the
+    block width when no column is set (an unknown category).
+
+    inputs:
+      - numerical: the indices of the numerical columns
+      - blocks: the column indices of every one-hot block
+      - max_bins: the maximum number of bins per numerical column
+      - subsample: the number of rows drawn to compute the thresholds, None for all
+      - random_state: the seed of the subsample
+    """
+
+    def __init__(self, numerical, blocks, max_bins = MAX_BINS, subsample = SUBSAMPLE,
+                 random_state = 0):
+        self.numerical = numerical
+        self.blocks = blocks
+        self.max_bins = max_bins
+        self.subsample = subsample
+        self.random_state = random_state
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor, **params):
+        """
+        Binner of the output columns of a fitted CensusPreprocessor
+        """
+
+        numerical = list(range(len(preprocessor.numerical)))
+        blocks = []
+        for column in preprocessor.categorical_:
+            offset = preprocessor.offsets_[column]
+            blocks.append(list(range(offset, offset + len(preprocessor.categories_[column]))))
+        return cls(numerical, blocks, **params)
+
+    def fit(self, X, y = None):
+        """
+        Compute the quantile thresholds of the numerical columns
+        """
+
+        if any(len(block) >= self.max_bins for block in self.blocks):
+            raise ValueError("QuantileBinner supports at most {} categories per field."
+                             .format(self.max_bins - 1))
+        rows = np.arange(X.shape[0])
+        if self.subsample is not None and X.shape[0] > self.subsample:
+            rng = np.random.RandomState(self.random_state)
+            rows = np.sort(rng.choice(X.shape[0], self.subsample, replace = False))
+        sample = X[rows][:, self.numerical]
+        sample = sample.toarray() if sp.issparse(sample) else np.asarray(sample)
+
+        self.thresholds_ = []
+        for j in range(sample.shape[1]):
+            values = np.unique(sample[:, j])
+            if len(values) <= self.max_bins:
+                # Few distinct values: one bin each, split halfway between them
+                thresholds = (values[:-1] + values[1:]) / 2.
+            else:
+                percentiles = np.linspace(0, 100, self.max_bins + 1)[1:-1]
+                thresholds = np.unique(np.percentile(sample[:, j], percentiles,
+                                                     method = 'midpoint'))
+            self.thresholds_.append(thresholds.astype(np.float64))
+
+        self.n_bins_ = np.array([len(t) + 1 for t in self.thresholds_] +
+                                [len(block) + 1 for block in self.blocks])
+        self.categorical_mask_ = np.array([False] * len(self.numerical) +
+                                          [True] * len(self.blocks))
+        return self
+
+    def transform(self, X):
+        """
+        The C-ordered uint8 code matrix of the encoded features, one chunk of rows at a time
+        """
+
+        codes = np.empty((X.shape[0], len(self.numerical) + len(self.blocks)), dtype = np.uint8)
+        n_numerical = len(self.numerical)
+        for start in range(0, X.shape[0], CHUNK_ROWS):
+            chunk = X[start:start + CHUNK_ROWS]
+            chunk = chunk.toarray() if sp.issparse(chunk) else np.asarray(chunk)
+            out = codes[start:start + CHUNK_ROWS]
+            for j, (column, thresholds) in enumerate(zip(self.numerical, self.thresholds_)):
+                out[:, j] = np.searchsorted(thresholds, chunk[:, column], side = 'left')
+            for j, block in enumerate(self.blocks):
+                indicators = chunk[:, block]
+                found = indicators.argmax(axis = 1)
+                found[indicators.max(axis = 1) <= 0] = len(block)
+                out[:, n_numerical + j] = found
+        return codes
+
+
+def hist_gradient_boosting(binner, **params):
+    """
+    HistGradientBoostingClassifier of a fitted QuantileBinner's codes
+
+    'params' are passed to the classifier, e.g. random_state or max_iter.
+    """
+
+    return HistGradientBoostingClassifier(categorical_features = binner.categorical_mask_,
+                                          max_bins = binner.max_bins, **params)
@@ -0,0 +1,242 @@
+"""
+On-disk caches of the preprocessed census feature matrix and of model fits.
+
+The encoded features and the income labels are stored as .npy files under a
+directory named after a content hash of 'census.csv' and of the preprocessing
+settings, and are loaded back memory-mapped so reruns and parallel workers
+share the same pages instead of redoing the preprocessing. Cross-validation
+fold scores are memoized in a size-bounded FitCache.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.preprocessing import MinMaxScaler
+
+import census
+from preprocessing import CensusPreprocessor
+
+
+# Default location of the cache, next to 'census.csv'
+DEFAULT_CACHE_DIR = ".feature_cache"
+
+# Bump when the layout or the preprocessing code changes in an incompatible way
+CACHE_VERSION = 4
+
+
+def file_digest(path, block_size = 1 << 20):
+    """
+    Hash the content of a file without loading it all in memory
+    """
+
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(path, skewed, numerical, scaler):
+    """
+    Key of the cached features: the data content plus every preprocessing setting
+    """
+
+    settings = {
+        'version': CACHE_VERSION,
+        'data': file_digest(path),
+        'skewed': skewed if isinstance(skewed, str) else list(skewed),
+        'numerical': list(numerical),
+        'scaler': [scaler.__class__.__name__, repr(sorted(scaler.get_params().items()))],
+        'categories': census.CATEGORIES,
+    }
+    blob = json.dumps(settings, sort_keys = True).encode('utf-8')
+    return hashlib.blake2b(blob, digest_size = 16).hexdigest()
+
+
+def _build(path, directory, preprocessor, chunksize):
+    """
+    Stream the census file through the preprocessor into .npy files in 'directory'
+    """
+
+    # First pass: fit the preprocessor and count the rows to size the output files
+    n_records = 0
+    for chunk in census.read_census(path, chunksize):
+        preprocessor.partial_fit(chunk.drop(census.TARGET, axis = 1))
+        n_records += len(chunk)
+
+    # Second pass: encode every chunk straight into the memory-mapped output
+    features = np.lib.format.open_memmap(os.path.join(directory, 'features.npy'),
+        mode = 'w+', dtype = np.float32, shape = (n_records, preprocessor.n_features_out_))
+    labels = np.lib.format.open_memmap(os.path.join(directory, 'income.npy'),
+        mode = 'w+', dtype = np.int8, shape = (n_records,))
+    start = 0
+    for chunk in census.read_census(path, chunksize):
+        features_raw, income = census.split_features(chunk)
+        end = start + len(chunk)
+        features[start:end] = preprocessor.transform(features_raw)
+        labels[start:end] = income.to_numpy()
+        start = end
+
+    features.flush()
+    labels.flush()
+    with open(os.path.join(directory, 'preprocessor.pkl'), 'wb') as f:
+        pickle.dump(preprocessor, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def load_features(path = "census.csv", cache_dir = DEFAULT_CACHE_DIR,
+                  skewed = census.SKEWED, numerical = census.NUMERICAL, scaler = None,
+                  chunksize = census.DEFAULT_CHUNKSIZE, return_key = False):
+    """
+    Load the encoded features from the cache, building it first if needed
+
+    inputs:
+      - path: the census CSV file
+      - cache_dir: the directory holding one sub-directory per cache key
+      - skewed: the columns to log-transform, or 'auto' to detect them
+      - numerical: the columns to min-max scale
+      - scaler: an unfitted scaler whose settings are part of the key; MinMaxScaler() if None
+      - chunksize: the number of rows per chunk when building the cache
+      - return_key: whether to return the cache key too, which saves hashing the file again
+
+    returns a read-only memory-mapped float32 feature matrix, the int8 income
+    vector and the CensusPreprocessor fitted on the whole file, then the
+    cache key if 'return_key' is set
+    """
+
+    if scaler is None:
+        scaler = MinMaxScaler()
+    key = cache_key(path, skewed, numerical, scaler)
+    directory = os.path.join(cache_dir, key)
+
+    if not os.path.isdir(directory):
+        # Build in a scratch directory and rename it, so concurrent workers
+        # never see a half-written cache entry
+        os.makedirs(cache_dir, exist_ok = True)
+        scratch = tempfile.mkdtemp(dir = cache_dir)
+        try:
+            preprocessor = CensusPreprocessor(skewed, numerical, scaler, census.CATEGORIES)
+            _build(path, scratch, preprocessor, chunksize)
+            os.rename(scratch, directory)
+        except OSError:
+            # Another worker won the race; its entry is identical
+            if not os.path.isdir(directory):
+                raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors = True)
+
+    features = np.load(os.path.join(directory, 'features.npy'), mmap_mode = 'r')
+    income = np.load(os.path.join(directory, 'income.npy'), mmap_mode = 'r')
+    with open(os.path.join(directory, 'preprocessor.pkl'), 'rb') as f:
+        preprocessor = pickle.load(f)
+    if return_key:
+        return features, income, preprocessor, key
+    return features, income, preprocessor
+
+
+# Default location and size bound of the cross-validation fit cache
+DEFAULT_FIT_CACHE_DIR = ".fit_cache"
+DEFAULT_FIT_CACHE_BYTES = 64 << 20
+
+
+def array_digest(*arrays):
+    """
+    Hash the content, dtype and shape of arrays (or CSR matrices)
+    """
+
+    digest = hashlib.blake2b(digest_size = 16)
+    for array in arrays:
+        parts = [array.data, array.indices, array.indptr] if sp.issparse(array) else [array]
+        for part in parts:
+            part = np.ascontiguousarray(part)
+            digest.update(repr((part.dtype.str, part.shape)).encode('utf-8'))
+            digest.update(part.view(np.uint8).reshape(-1))
+    return digest.hexdigest()
+
+
+class FitCache(object):
+    """
+    Persistent memoization of cross-validation fold scores.
+
+    Each entry is the score of one (data set, estimator class, parameters,
+    scorer, fold) combination, stored as a small JSON file named after the hash of
+    that combination. Reading an entry marks it as recently used; 'evict'
+    removes the least recently used entries until the cache fits in
+    'max_bytes'. Entries are written atomically, so worker processes can
+    share one cache directory.
+
+    inputs:
+      - directory: where the entries are stored
+      - max_bytes: the size bound enforced by evict
+    """
+
+    def __init__(self, directory = DEFAULT_FIT_CACHE_DIR, max_bytes = DEFAULT_FIT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    @staticmethod
+    def key(data_digest, estimator, scorer, train, test):
+        """
+        Key of one fold score: the data, the fully parameterised estimator, the scorer and the fold
+        """
+
+        params = sorted(estimator.get_params(deep = True).items())
+        settings = [data_digest, sklearn.__version__,
+                    estimator.__class__.__module__, estimator.__class__.__name__,
+                    repr(params), repr(scorer), array_digest(np.asarray(train), np.asarray(test))]
+        blob = json.dumps(settings).encode('utf-8')
+        return hashlib.blake2b(blob, digest_size = 20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """
+        The cached entry for 'key', or None
+        """
+
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        """
+        Store the JSON-serialisable 'entry' under 'key'
+        """
+
+        descriptor, scratch = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(entry, f)
+        os.replace(scratch, self._path(key))
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in 'max_bytes'
+        """
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,173 @@
+"""
+Census data loading and preprocessing for the CharityML donors project.
+
+The census extracts are read in chunks with explicit dtypes so that the peak
+memory of the pipeline is bounded by the chunk size rather than the file size.
+The chunks are encoded into model features by preprocessing.CensusPreprocessor.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+# Rows read from 'census.csv' per chunk
+DEFAULT_CHUNKSIZE = 100000
+
+# Target column and its two income classes, encoded as 0 and 1
+TARGET = 'income'
+LABELS = ['<=50K', '>50K']
+
+# Continuous features, and the heavily skewed ones among them
+NUMERICAL = ['age', 'education-num', 'capital-gain', 'capital-loss', 'hours-per-week']
+SKEWED = ['capital-gain', 'capital-loss']
+
+# Absolute skewness above which a numerical column is considered skewed
+SKEW_THRESHOLD = 1.0
+
+# Category vocabulary of every string feature. Fixing it up front keeps the
+# one-hot columns identical across chunks. 'Never-worked' is absent because
+# those records have no occupation and were removed from the modified dataset.
+CATEGORIES = {
+    'workclass': ['Federal-gov', 'Local-gov', 'Private', 'Self-emp-inc',
+                  'Self-emp-not-inc', 'State-gov', 'Without-pay'],
+    'education_level': ['10th', '11th', '12th', '1st-4th', '5th-6th', '7th-8th', '9th',
+                        'Assoc-acdm', 'Assoc-voc', 'Bachelors', 'Doctorate', 'HS-grad',
+                        'Masters', 'Preschool', 'Prof-school', 'Some-college'],
+    'marital-status': ['Divorced', 'Married-AF-spouse', 'Married-civ-spouse',
+                       'Married-spouse-absent', 'Never-married', 'Separated', 'Widowed'],
+    'occupation': ['Adm-clerical', 'Armed-Forces', 'Craft-repair', 'Exec-managerial',
+                   'Farming-fishing', 'Handlers-cleaners', 'Machine-op-inspct',
+                   'Other-service', 'Priv-house-serv', 'Prof-specialty',
+                   'Protective-serv', 'Sales', 'Tech-support', 'Transport-moving'],
+    'relationship': ['Husband', 'Not-in-family', 'Other-relative', 'Own-child',
+                     'Unmarried', 'Wife'],
+    'race': ['Amer-Indian-Eskimo', 'Asian-Pac-Islander', 'Black', 'Other', 'White'],
+    'sex': ['Female', 'Male'],
+    'native-country': ['Cambodia', 'Canada', 'China', 'Columbia', 'Cuba',
+                       'Dominican-Republic', 'Ecuador', 'El-Salvador', 'England',
+                       'France', 'Germany', 'Greece', 'Guatemala', 'Haiti',
+                       'Holand-Netherlands', 'Honduras', 'Hong', 'Hungary', 'India',
+                       'Iran', 'Ireland', 'Italy', 'Jamaica', 'Japan', 'Laos',
+                       'Mexico', 'Nicaragua', 'Outlying-US(Guam-USVI-etc)', 'Peru',
+                       'Philippines', 'Poland', 'Portugal', 'Puerto-Rico', 'Scotland',
+                       'South', 'Taiwan', 'Thailand', 'Trinadad&Tobago',
+                       'United-States', 'Vietnam', 'Yugoslavia'],
+}
+
+# Explicit column dtypes: categories for the strings, small ints for the counts
+DTYPES = {
+    'age': 'int16',
+    'education-num': 'int16',
+    'capital-gain': 'float32',
+    'capital-loss': 'float32',
+    'hours-per-week': 'int16',
+    TARGET: pd.CategoricalDtype(LABELS),
+}
+DTYPES.update({name: pd.CategoricalDtype(values) for name, values in CATEGORIES.items()})
+
+# The small int columns are parsed as int64 and narrowed after a range check,
+# because read_csv wraps out-of-range values silently (age=200 in int8 is -56)
+NARROWED = [name for name, dtype in DTYPES.items()
+            if isinstance(dtype, str) and dtype.startswith('int')]
+READ_DTYPES = dict(DTYPES, **{name: 'int64' for name in NARROWED})
+
+# The string columns are parsed with the categories found in each chunk and
+# checked against their vocabulary, which would otherwise turn unknown values
+# into NaN without a word (the label '>50K.' of UCI's adult.test, for one)
+CATEGORICAL = [name for name, dtype in DTYPES.items()
+               if isinstance(dtype, pd.CategoricalDtype)]
+READ_DTYPES.update({name: 'category' for name in CATEGORICAL})
+
+
+def _narrow(chunk):
+    """
+    Cast the int64 columns of a chunk to their DTYPES, raising on values that do not fit
+    """
+
+    for name in NARROWED:
+        if name not in chunk:
+            continue
+        limits = np.iinfo(DTYPES[name])
+        values = chunk[name].to_numpy()
+        outside = (values < limits.min) | (values > limits.max)
+        if outside.any():
+            raise ValueError("Column '{}' has value {} at row {}, outside the {} range."
+                             .format(name, values[outside][0], chunk.index[outside][0],
+                                     DTYPES[name]))
+        chunk[name] = values.astype(DTYPES[name])
+    return chunk
+
+
+def _categorize(chunk):
+    """
+    Cast the string columns of a chunk to their DTYPES vocabulary
+
+    An income that is missing or not one of LABELS raises; a feature value
+    outside CATEGORIES warns and encodes as unknown (NaN).
+    """
+
+    for name in CATEGORICAL:
+        if name not in chunk:
+            continue
+        column = chunk[name]
+        expected = DTYPES[name].categories
+        unknown = column.notna() & ~column.isin(expected)
+        if name == TARGET and (unknown | column.isna()).any():
+            row = (unknown | column.isna()).to_numpy().argmax()
+            raise ValueError("Column '{}' has value {!r} at row {}, not one of {}."
+                             .format(name, column.iloc[row], chunk.index[row], list(expected)))
+        if unknown.any():
+            row = unknown.to_numpy().argmax()
+            warnings.warn("Column '{}' has {} values outside its categories, such as {!r} "
+                          "at row {}; they are encoded as unknown."
+                          .format(name, int(unknown.sum()), column.iloc[row], chunk.index[row]))
+        chunk[name] = column.astype(DTYPES[name])
+    return chunk
+
+
+def read_census(path = "census.csv", chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Stream the census file as typed DataFrame chunks of at most 'chunksize' rows
+    """
+
+    # 'skipinitialspace' strips the blank that follows every comma in the file
+    reader = pd.read_csv(path, dtype = READ_DTYPES, skipinitialspace = True,
+                         chunksize = chunksize)
+    with reader:
+        for chunk in reader:
+            yield _categorize(_narrow(chunk))
+
+
+def load_census(path = "census.csv", chunksize = DEFAULT_CHUNKSIZE):
+    """
+    Load the whole census file as one typed DataFrame, one chunk at a time
+    """
+
+    return pd.concat(read_census(path, chunksize), ignore_index = True)
+
+
+def split_features(data):
+    """
+    Split a census frame into its raw features and the 0/1 encoded income label
+    """
+
+    codes = data[TARGET].cat.codes
+    if (codes < 0).any():
+        row = (codes < 0).to_numpy().argmax()
+        raise ValueError("Column '{}' is missing or unknown at row {}."
+                         .format(TARGET, data.index[row]))
+    features_raw = data.drop(TARGET, axis = 1)
+    income = pd.Series(codes.astype(np.int8), index = data.index, name = TARGET)
+    return features_raw, income
+
+
+def skewed_columns(features, numerical = NUMERICAL, threshold = SKEW_THRESHOLD):
+    """
+    Names of the numerical columns whose absolute skewness exceeds 'threshold'
+    """
+
+    skewness = features[numerical].astype(np.float64).skew()
+    return list(skewness.index[skewness.abs() > threshold])
+
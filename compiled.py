@@ -0,0 +1,160 @@
+"""
+Compiled inference for linear models trained on CensusPreprocessor features.
+
+The log transform, the min-max scaling and the linear model are folded into
+one weight per numerical column plus an intercept, and every one-hot block is
+folded into a table of weights per category. Scoring a record is then a few
+multiply-adds and table lookups: no pandas and no dummy matrix.
+"""
+
+import math
+
+import numpy as np
+
+
+class LinearScorer(object):
+    """
+    Fused preprocessing and linear decision function.
+
+    decision(record) = intercept
+                       + sum of weight * (log1p(value) if skewed else value) over numerical columns
+                       + sum of the category weight of each categorical column
+
+    A record is predicted positive when its decision value is above
+    'threshold'. Build it with compile_linear.
+    """
+
+    def __init__(self, numerical, skewed, weights, intercept, tables, clip = None,
+                 classes = (0, 1), threshold = 0.0):
+        self.numerical = list(numerical)
+        self.skewed = [name in skewed for name in numerical]
+        self.weights = np.asarray(weights, dtype = np.float64)
+        self.intercept = float(intercept)
+        self.tables = tables
+        self.clip = clip
+        self.classes_ = np.asarray(classes)
+        self.threshold = float(threshold)
+
+        # Per-row loop constants, and the table arrays of the vectorized path
+        # where code -1 (unknown category) maps to the trailing 0 weight
+        self._numeric_spec = list(zip(self.numerical, self.weights.tolist(), self.skewed))
+        self._bounds = None if clip is None else list(zip(*[np.ravel(b).tolist() for b in clip]))
+        self._table_spec = list(tables.items())
+        self._skewed_columns = np.flatnonzero(self.skewed)
+        self._table_arrays = [np.append(np.fromiter(table.values(), np.float64), 0.0)
+                              for table in tables.values()]
+
+    def decision_function_records(self, records, out = None):
+        """
+        Decision values of an iterable of raw record dicts
+
+        inputs:
+          - records: dicts with the census feature columns
+          - out: an optional preallocated float64 array to write into
+        """
+
+        if out is None:
+            records = list(records)
+            out = np.empty(len(records), dtype = np.float64)
+        log1p = math.log1p
+        intercept, numeric_spec, table_spec = self.intercept, self._numeric_spec, self._table_spec
+        bounds = self._bounds
+
+        for i, record in enumerate(records):
+            value = intercept
+            for j, (name, weight, skewed) in enumerate(numeric_spec):
+                x = log1p(record[name]) if skewed else record[name]
+                if bounds is not None:
+                    x = min(max(x, bounds[j][0]), bounds[j][1])
+                value += weight * x
+            for name, table in table_spec:
+                value += table.get(record[name], 0.0)
+            out[i] = value
+        return out
+
+    def decision_function_arrays(self, numeric, codes, out = None):
+        """
+        Decision values of column arrays
+
+        inputs:
+          - numeric: an (n, len(numerical)) array of raw numerical values
+          - codes: an (n, len(tables)) int array of category codes, in the
+            order of each table, -1 for unknown categories
+          - out: an optional preallocated float64 array to write into
+        """
+
+        numeric = np.array(numeric, dtype = np.float64, order = 'F')
+        for j in self._skewed_columns:
+            np.log1p(numeric[:, j], out = numeric[:, j])
+        if self.clip is not None:
+            np.clip(numeric, self.clip[0], self.clip[1], out = numeric)
+
+        out = np.dot(numeric, self.weights, out = out)
+        out += self.intercept
+        for j, table in enumerate(self._table_arrays):
+            out += table[codes[:, j]]
+        return out
+
+    def predict_records(self, records):
+        """
+        Predicted classes of an iterable of raw record dicts
+        """
+
+        return self.classes_[(self.decision_function_records(records) > self.threshold).astype(int)]
+
+    def predict_arrays(self, numeric, codes):
+        """
+        Predicted classes of column arrays, see decision_function_arrays
+        """
+
+        return self.classes_[(self.decision_function_arrays(numeric, codes) > self.threshold).astype(int)]
+
+
+def compile_linear(preprocessor, model, columns = None, threshold = 0.0):
+    """
+    Fold a fitted CensusPreprocessor and binary linear model into a LinearScorer
+
+    inputs:
+      - preprocessor: a CensusPreprocessor fitted with a MinMaxScaler
+      - model: a fitted binary linear classifier such as SGDClassifier
+      - columns: the indices of the preprocessor columns the model was fitted
+        on, None for all of them; the other columns get a zero weight
+      - threshold: the decision value above which a record is predicted positive
+
+    The scaler maps the (log-transformed) value x of numerical column j to
+    x * scale_j + min_j, so that column contributes w_j * scale_j * x and adds
+    w_j * min_j to the intercept.
+    """
+
+    scaler = preprocessor.scaler_
+    if not (hasattr(scaler, 'scale_') and hasattr(scaler, 'min_')):
+        raise TypeError("compile_linear needs a fitted MinMaxScaler, not {}."
+                        .format(scaler.__class__.__name__))
+    coef = np.ravel(model.coef_)
+    n_columns = preprocessor.n_features_out_ if columns is None else len(columns)
+    if np.shape(model.coef_)[0] != 1 or len(coef) != n_columns:
+        raise ValueError("compile_linear needs a binary linear model over "
+                         "{} preprocessor columns.".format(n_columns))
+    if columns is not None:
+        coef = np.zeros(preprocessor.n_features_out_)
+        coef[np.asarray(columns)] = np.ravel(model.coef_)
+
+    n_numerical = len(preprocessor.numerical)
+    numeric_coef = coef[:n_numerical]
+    weights = numeric_coef * scaler.scale_
+    intercept = float(np.ravel(model.intercept_)[0]) + float(np.dot(numeric_coef, scaler.min_))
+
+    tables = {}
+    for column in preprocessor.categorical_:
+        offset = preprocessor.offsets_[column]
+        values = preprocessor.categories_[column]
+        tables[column] = dict(zip(values, coef[offset:offset + len(values)].tolist()))
+
+    # A clipping scaler bounds the scaled values to its range, i.e. the raw ones to the data range
+    clip = None
+    if getattr(scaler, 'clip', False):
+        low, high = scaler.feature_range
+        clip = ((low - scaler.min_) / scaler.scale_, (high - scaler.min_) / scaler.scale_)
+
+    return LinearScorer(preprocessor.numerical, preprocessor.skewed_, weights, intercept, tables,
+                        clip, model.classes_, threshold)
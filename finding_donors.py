@@ -1,668 +1,692 @@
 #!/usr/bin/env python
-# coding: utf-8
+"""
+Batch pipeline of the Finding Donors for CharityML project.
+
+Runs the stages of finding_donors.ipynb without a notebook kernel:
+
+    python finding_donors.py prepare              # encode census.csv into the feature cache
+    python finding_donors.py train                # compare the learners with train_predict
+    python finding_donors.py tune                 # tune SGDClassifier, save best_clf
+    python finding_donors.py reduce               # refit best_clf on fewer features
+    python finding_donors.py threshold            # tune the F-score cutoff of both models
+    python finding_donors.py all                  # the five stages above
+    python finding_donors.py score new.csv        # score a census file with a saved model
+    python finding_donors.py stream national.csv  # train best_clf's parameters out of core
+    python finding_donors.py bench -- --sizes 45222 1000000
+
+The outputs of every stage are written under --workdir, to a JSON file named
+after a hash of the stage inputs: the data, the settings and the outputs of
+the stages it depends on. A stage whose file exists is not run again, so an
+interrupted run resumes at the first missing stage (and, within 'train', at
+the first missing learner); --force reruns them. The fold scores of 'tune'
+persist in the FitCache, so even a rerun tuning only fits the new folds.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
 
-# ## Supervised Learning
-# ## Project: Finding Donors for *CharityML*
-
-# ## Getting Started
-# 
-# In this project, you will employ several supervised algorithms of your choice to accurately model individuals' income using data collected from the 1994 U.S. Census. You will then choose the best candidate algorithm from preliminary results and further optimize this algorithm to best model the data. Your goal with this implementation is to construct a model that accurately predicts whether an individual makes more than $50,000. This sort of task can arise in a non-profit setting, where organizations survive on donations.  Understanding an individual's income can help a non-profit better understand how large of a donation to request, or whether or not they should reach out to begin with.  While it can be difficult to determine an individual's general income bracket directly from public sources, we can (as we will see) infer this value from other publically available features. 
-# 
-# The dataset for this project originates from the [UCI Machine Learning Repository](https://archive.ics.uci.edu/ml/datasets/Census+Income). The datset was donated by Ron Kohavi and Barry Becker, after being published in the article _"Scaling Up the Accuracy of Naive-Bayes Classifiers: A Decision-Tree Hybrid"_. You can find the article by Ron Kohavi [online](https://www.aaai.org/Papers/KDD/1996/KDD96-033.pdf). The data we investigate here consists of small changes to the original dataset, such as removing the `'fnlwgt'` feature and records with missing or ill-formatted entries.
-
-# ----
-# ## Exploring the Data
-# Run the code cell below to load necessary Python libraries and load the census data. Note that the last column from this dataset, `'income'`, will be our target label (whether an individual makes more than, or at most, $50,000 annually). All other columns are features about each individual in the census database.
-
-# In[1]:
-
-
-# Import libraries necessary for this project
 import numpy as np
-import pandas as pd
-from time import time
-from IPython.display import display # Allows the use of display() for DataFrames
-
-# Import supplementary visualization code visuals.py
-import visuals as vs
-
-# Pretty display for notebooks
-get_ipython().run_line_magic('matplotlib', 'inline')
-
-# Load the Census dataset
-data = pd.read_csv("census.csv")
-
-# Success - Display the first record
-display(data.head(n=1))
-
-
-# ### Implementation: Data Exploration
-# A cursory investigation of the dataset will determine how many individuals fit into either group, and will tell us about the percentage of these individuals making more than \$50,000. In the code cell below, you will need to compute the following:
-# - The total number of records, `'n_records'`
-# - The number of individuals making more than \$50,000 annually, `'n_greater_50k'`.
-# - The number of individuals making at most \$50,000 annually, `'n_at_most_50k'`.
-# - The percentage of individuals making more than \$50,000 annually, `'greater_percent'`.
-# 
-# ** HINT: ** You may need to look at the table above to understand how the `'income'` entries are formatted. 
-
-# In[2]:
-
-
-data.income.value_counts() , data.shape
-
-
-# In[3]:
-
-
-# Total number of records
-n_records = data.shape[0] 
-
-# Number of records where individual's income is more than $50,000
-n_greater_50k = data.income.value_counts()[1]
-
-# Number of records where individual's income is at most $50,000
-n_at_most_50k = data.income.value_counts()[0]
-
-# Percentage of individuals whose income is more than $50,000
-greater_percent = 100 * n_greater_50k/n_records
-
-# Print the results
-print("Total number of records: {}".format(n_records))
-print("Individuals making more than $50,000: {}".format(n_greater_50k))
-print("Individuals making at most $50,000: {}".format(n_at_most_50k))
-print("Percentage of individuals making more than $50,000: {}%".format(greater_percent))
-
-
-# ** Featureset Exploration **
-# 
-# * **age**: continuous. 
-# * **workclass**: Private, Self-emp-not-inc, Self-emp-inc, Federal-gov, Local-gov, State-gov, Without-pay, Never-worked. 
-# * **education**: Bachelors, Some-college, 11th, HS-grad, Prof-school, Assoc-acdm, Assoc-voc, 9th, 7th-8th, 12th, Masters, 1st-4th, 10th, Doctorate, 5th-6th, Preschool. 
-# * **education-num**: continuous. 
-# * **marital-status**: Married-civ-spouse, Divorced, Never-married, Separated, Widowed, Married-spouse-absent, Married-AF-spouse. 
-# * **occupation**: Tech-support, Craft-repair, Other-service, Sales, Exec-managerial, Prof-specialty, Handlers-cleaners, Machine-op-inspct, Adm-clerical, Farming-fishing, Transport-moving, Priv-house-serv, Protective-serv, Armed-Forces. 
-# * **relationship**: Wife, Own-child, Husband, Not-in-family, Other-relative, Unmarried. 
-# * **race**: Black, White, Asian-Pac-Islander, Amer-Indian-Eskimo, Other. 
-# * **sex**: Female, Male. 
-# * **capital-gain**: continuous. 
-# * **capital-loss**: continuous. 
-# * **hours-per-week**: continuous. 
-# * **native-country**: United-States, Cambodia, England, Puerto-Rico, Canada, Germany, Outlying-US(Guam-USVI-etc), India, Japan, Greece, South, China, Cuba, Iran, Honduras, Philippines, Italy, Poland, Jamaica, Vietnam, Mexico, Portugal, Ireland, France, Dominican-Republic, Laos, Ecuador, Taiwan, Haiti, Columbia, Hungary, Guatemala, Nicaragua, Scotland, Thailand, Yugoslavia, El-Salvador, Trinadad&Tobago, Peru, Hong, Holand-Netherlands.
-
-# ----
-# ## Preparing the Data
-# Before data can be used as input for machine learning algorithms, it often must be cleaned, formatted, and restructured — this is typically known as **preprocessing**. Fortunately, for this dataset, there are no invalid or missing entries we must deal with, however, there are some qualities about certain features that must be adjusted. This preprocessing can help tremendously with the outcome and predictive power of nearly all learning algorithms.
-
-# ### Transforming Skewed Continuous Features
-# A dataset may sometimes contain at least one feature whose values tend to lie near a single number, but will also have a non-trivial number of vastly larger or smaller values than that single number.  Algorithms can be sensitive to such distributions of values and can underperform if the range is not properly normalized. With the census dataset two features fit this description: '`capital-gain'` and `'capital-loss'`. 
-# 
-# Run the code cell below to plot a histogram of these two features. Note the range of the values present and how they are distributed.
-
-# In[4]:
-
-
-# Split the data into features and target label
-income_raw = data['income']
-features_raw = data.drop('income', axis = 1)
-
-# Visualize skewed continuous features of original data
-vs.distribution(data)
-
-
-# For highly-skewed feature distributions such as `'capital-gain'` and `'capital-loss'`, it is common practice to apply a <a href="https://en.wikipedia.org/wiki/Data_transformation_(statistics)">logarithmic transformation</a> on the data so that the very large and very small values do not negatively affect the performance of a learning algorithm. Using a logarithmic transformation significantly reduces the range of values caused by outliers. Care must be taken when applying this transformation however: The logarithm of `0` is undefined, so we must translate the values by a small amount above `0` to apply the the logarithm successfully.
-# 
-# Run the code cell below to perform a transformation on the data and visualize the results. Again, note the range of values and how they are distributed. 
-
-# In[5]:
-
-
-# Log-transform the skewed features
-skewed = ['capital-gain', 'capital-loss']
-features_log_transformed = pd.DataFrame(data = features_raw)
-features_log_transformed[skewed] = features_raw[skewed].apply(lambda x: np.log(x + 1))
-
-# Visualize the new log distributions
-vs.distribution(features_log_transformed, transformed = True)
-
-
-# ### Normalizing Numerical Features
-# In addition to performing transformations on features that are highly skewed, it is often good practice to perform some type of scaling on numerical features. Applying a scaling to the data does not change the shape of each feature's distribution (such as `'capital-gain'` or `'capital-loss'` above); however, normalization ensures that each feature is treated equally when applying supervised learners. Note that once scaling is applied, observing the data in its raw form will no longer have the same original meaning, as exampled below.
-# 
-# Run the code cell below to normalize each numerical feature. We will use [`sklearn.preprocessing.MinMaxScaler`](http://scikit-learn.org/stable/modules/generated/sklearn.preprocessing.MinMaxScaler.html) for this.
-
-# In[6]:
-
-
-# Import sklearn.preprocessing.StandardScaler
-from sklearn.preprocessing import MinMaxScaler
-
-# Initialize a scaler, then apply it to the features
-scaler = MinMaxScaler() # default=(0, 1)
-numerical = ['age', 'education-num', 'capital-gain', 'capital-loss', 'hours-per-week']
-
-features_log_minmax_transform = pd.DataFrame(data = features_log_transformed)
-features_log_minmax_transform[numerical] = scaler.fit_transform(features_log_transformed[numerical])
-
-# Show an example of a record with scaling applied
-display(features_log_minmax_transform.head(n = 5))
-
-
-# ### Implementation: Data Preprocessing
-# .
-
-# In[21]:
-
-
-#One-hot encode the 'features_log_minmax_transform' data using pandas.get_dummies()
-features_final = pd.get_dummies(features_log_minmax_transform)
-
-#Encode the 'income_raw' data to numerical values
-replace_dict = {'<=50K':0, '>50K':1} 
-income = income_raw.replace(replace_dict)
-
-# Print the number of features after one-hot encoding
-encoded = list(features_final.columns)
-print("{} total features after one-hot encoding.".format(len(encoded)))
-
-# Uncomment the following line to see the encoded feature names
-#print(encoded)
-
-
-# ### Shuffle and Split Data
-# Now all _categorical variables_ have been converted into numerical features, and all numerical features have been normalized. As always, we will now split the data (both features and their labels) into training and test sets. 80% of the data will be used for training and 20% for testing.
-# 
-# Run the code cell below to perform this split.
-
-# In[9]:
-
-
-# Import train_test_split
-from sklearn.model_selection import train_test_split
-
-# Split the 'features' and 'income' data into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(features_final, 
-                                                    income, 
-                                                    test_size = 0.2, 
-                                                    random_state = 0)
-
-# Show the results of the split
-print("Training set has {} samples.".format(X_train.shape[0]))
-print("Testing set has {} samples.".format(X_test.shape[0]))
-
-
-# *Note: this Workspace is running on `sklearn` v0.19. If you use the newer version (>="0.20"), the `sklearn.cross_validation` has been replaced with `sklearn.model_selection`.*
-
-# ----
-# ## Evaluating Model Performance
-# In this section, we will investigate four different algorithms, and determine which is best at modeling the data. Three of these algorithms will be supervised learners of your choice, and the fourth algorithm is known as a *naive predictor*.
-
-# ### Metrics and the Naive Predictor
-# *CharityML*, equipped with their research, knows individuals that make more than \$50,000 are most likely to donate to their charity. Because of this, *CharityML* is particularly interested in predicting who makes more than \$50,000 accurately. It would seem that using **accuracy** as a metric for evaluating a particular model's performace would be appropriate. Additionally, identifying someone that *does not* make more than \$50,000 as someone who does would be detrimental to *CharityML*, since they are looking to find individuals willing to donate. Therefore, a model's ability to precisely predict those that make more than \$50,000 is *more important* than the model's ability to **recall** those individuals. We can use **F-beta score** as a metric that considers both precision and recall:
-# 
-# $$ F_{\beta} = (1 + \beta^2) \cdot \frac{precision \cdot recall}{\left( \beta^2 \cdot precision \right) + recall} $$
-# 
-# In particular, when $\beta = 0.5$, more emphasis is placed on precision. This is called the **F$_{0.5}$ score** (or F-score for simplicity).
-# 
-# Looking at the distribution of classes (those who make at most \$50,000, and those who make more), it's clear most individuals do not make more than \$50,000. This can greatly affect **accuracy**, since we could simply say *"this person does not make more than \$50,000"* and generally be right, without ever looking at the data! Making such a statement would be called **naive**, since we have not considered any information to substantiate the claim. It is always important to consider the *naive prediction* for your data, to help establish a benchmark for whether a model is performing well. That been said, using that prediction would be pointless: If we predicted all people made less than \$50,000, *CharityML* would identify no one as donors. 
-# 
-# 
-# #### Note: Recap of accuracy, precision, recall
-# 
-# ** Accuracy ** measures how often the classifier makes the correct prediction. It’s the ratio of the number of correct predictions to the total number of predictions (the number of test data points).
-# 
-# ** Precision ** tells us what proportion of messages we classified as spam, actually were spam.
-# It is a ratio of true positives(words classified as spam, and which are actually spam) to all positives(all words classified as spam, irrespective of whether that was the correct classificatio), in other words it is the ratio of
-# 
-# `[True Positives/(True Positives + False Positives)]`
-# 
-# ** Recall(sensitivity)** tells us what proportion of messages that actually were spam were classified by us as spam.
-# It is a ratio of true positives(words classified as spam, and which are actually spam) to all the words that were actually spam, in other words it is the ratio of
-# 
-# `[True Positives/(True Positives + False Negatives)]`
-# 
-# For classification problems that are skewed in their classification distributions like in our case, for example if we had a 100 text messages and only 2 were spam and the rest 98 weren't, accuracy by itself is not a very good metric. We could classify 90 messages as not spam(including the 2 that were spam but we classify them as not spam, hence they would be false negatives) and 10 as spam(all 10 false positives) and still get a reasonably good accuracy score. For such cases, precision and recall come in very handy. These two metrics can be combined to get the F1 score, which is weighted average(harmonic mean) of the precision and recall scores. This score can range from 0 to 1, with 1 being the best possible F1 score(we take the harmonic mean as we are dealing with ratios).
-
-# ### Naive Predictor Performace
-# 
-# 
-# * When we have a model that always predicts '1' (i.e. the individual makes more than 50k) then our model will have no True Negatives(TN) or False Negatives(FN) as we are not making any negative('0' value) predictions. Therefore our Accuracy in this case becomes the same as our Precision(True Positives/(True Positives + False Positives)) as every prediction that we have made with value '1' that should have '0' becomes a False Positive; therefore our denominator in this case is the total number of records we have in total. 
-# * Our Recall score(True Positives/(True Positives + False Negatives)) in this setting becomes 1 as we have no False Negatives.
-
-# In[10]:
-
-
-TP = np.sum(income) # Counting the ones as this is the naive case. Note that 'income' is the 'income_raw' data encoded to numerical values done in the data preprocessing step.
-FP = income.count() - TP # Specific to the naive case
-
-TN = 0 # No predicted negatives in the naive case
-FN = 0 # No predicted negatives in the naive case
-
-# Calculate accuracy, precision and recall
-accuracy = TP / income.count()
-recall = TP / (TP + FN)
-precision = TP / (TP + FP)
-
-# Calculate F-score using the formula above for beta = 0.5 and correct values for precision and recall.
-fscore = (1+ 0.5**2) * (precision*recall) / ((0.5**2)*precision + recall)
-
-# Print the results 
-
-print("Naive Predictor: [Accuracy score: {:.4f}, F-score: {:.4f}]".format(accuracy, fscore))
-
-
-# ###  Supervised Learning Models
-# **The following are some of the supervised learning models that are currently available in** [`scikit-learn`](http://scikit-learn.org/stable/supervised_learning.html)
-# - Gaussian Naive Bayes (GaussianNB)
-# - Decision Trees
-# - Ensemble Methods (Bagging, AdaBoost, Random Forest, Gradient Boosting)
-# - K-Nearest Neighbors (KNeighbors)
-# - Stochastic Gradient Descent Classifier (SGDC)
-# - Support Vector Machines (SVM)
-# - Logistic Regression
-
-# ## List of Content:
-# 
-# #### 1.Random Forest Model.
-# 
-#     1.1. Application of Random Forest Model.
-#     1.2. Model Strengths.
-#     1.3. Model Weaknesses.
-#     1.4. Negotiation between the Algorithem and the Data.
-# 
-# 
-# #### 2.Support Vector Machines (SVM) Model.
-# 
-#     2.1. Application of SVM Model.
-#     2.2. Model Strengths.
-#     2.3. Model Weaknesses.
-#     2.4. Negotiation between the Algorithem and the Data.
-#     
-#     
-# #### 3.Stochastic Gradient Descent Classifier (SGDC) Model.
-# 
-#     2.1. Application of SGDC Model.
-#     2.2. Model Strengths.
-#     2.3. Model Weaknesses.
-#     2.4. Negotiation between the Algorithem and the Data.
-
-# ## 1.Random Forest Model.
-# 
-# #### 1.1. Application of Random Forest Model :
-# 
-#     Financial, Medical sectors and remotely-sensed imagery classification.
-# 
-# 
-# 
-# #### 1.2. Model Strengths :
-# 
-#    * Accuracy of Random forest is generally very high
-#    * Its efficiency is particularly Notable in Large Data sets
-#    * Provides an estimate of important variables in classification
-#    * Forests Generated can be saved and reused
-#    * Unlike other models It does nt overfit with more features
-# 
-# 
-# #### 1.3. Model Weaknesses :
-# 
-#    * It requires much computational power as well as resources as it builds numerous trees to combine their outputs. 
-#    * It also requires much time for training as it combines a lot of decision trees to determine the class.
-#    * Due to the ensemble of decision trees, it also suffers interpretability and fails to determine the significance of each variable.
-#    
-#    
-# #### 1.4. Negotiation between the Algorithem and the Data :
-# 
-#    * It's a financial Problem so we need a high accuracy model to predict our income.
-#    * we have alot of data so this kind of algorithems work extremly good with.
-#    * we have alot of variables and this model can ignore overfit very well.
-#    
-
-# ## 2. Support Vector Machines (SVM) Model.
-# 
-# #### 1.1. Application of SVM Model :
-# 
-# * text and hypertext categorization
-# * Classification of images
-# * Hand-Written recognition.
-# 
-# 
-# #### 1.2. Model Strengths :
-# 
-# * SVM works relatively well when there is a clear margin of separation between classes.
-# * SVM is more effective in high dimensional spaces.
-# * SVM is effective in cases where the number of dimensions is greater than the number of samples.
-# * SVM is relatively memory efficient
-# 
-# #### 1.3. Model Weaknesses :
-# 
-# * SVM algorithm is not suitable for large data sets.
-# * SVM does not perform very well when the data set has more noise i.e. target classes are overlapping.
-# * In cases where the number of features for each data point exceeds the number of training data samples, the SVM will underperform.
-# * As the support vector classifier works by putting data points, above and below the classifying hyperplane there is no * * probabilistic explanation for the classification.
-#    
-#    
-# #### 1.4. Negotiation between the Algorithem and the Data :
-# 
-# * SVM Works well with large features.
-# * Have enough Data samples to train.
-# * Not very Big Data we're dealing with.
-
-# ## 3. Stochastic Gradient Descent Classifier (SGDC) Model.
-# 
-# #### 1.1. Application of SGDC Model :
-# 
-# 
-#     Classification of images
-# 
-# 
-# #### 1.2. Model Strengths :
-# 
-# * It is easier to fit in the memory due to a single training example being processed by the network.
-# * It is computationally fast as only one sample is processed at a time.
-# * For larger datasets, it can converge faster as it causes updates to the parameters more frequently.
-# * Due to frequent updates, the steps taken towards the minima of the loss function have oscillations that can help to get out of the local minimums of the loss function (in case the computed position turns out to be the local minimum).
-# 
-# #### 1.3. Model Weaknesses :
-# 
-# * Due to frequent updates, the steps taken towards the minima are very noisy. This can often lean the gradient descent into other directions.
-# * Also, due to noisy steps, it may take longer to achieve convergence to the minima of the loss function.
-# * Frequent updates are computationally expensive because of using all resources for processing one training sample at a time.
-# * It loses the advantage of vectorized operations as it deals with only a single example at a time.
-#    
-#    
-# #### 1.4. Negotiation between the Algorithem and the Data :
-# 
-# * works well with labeled data.
-# * Have enough Data samples to train.
-# * Not very Big Data we're dealing with.
-
-# ### Implementation - Creating a Training and Predicting Pipeline
-# To properly evaluate the performance of each model you've chosen, it's important that you create a training and predicting pipeline that allows you to quickly and effectively train models using various sizes of training data and perform predictions on the testing data. Your implementation here will be used in the following section.
-# In the code block below, you will need to implement the following:
-#  - Import `fbeta_score` and `accuracy_score` from [`sklearn.metrics`](http://scikit-learn.org/stable/modules/classes.html#sklearn-metrics-metrics).
-#  - Fit the learner to the sampled training data and record the training time.
-#  - Perform predictions on the test data `X_test`, and also on the first 300 training points `X_train[:300]`.
-#    - Record the total prediction time.
-#  - Calculate the accuracy score for both the training subset and testing set.
-#  - Calculate the F-score for both the training subset and testing set.
-#    - Make sure that you set the `beta` parameter!
-
-# In[11]:
-
-
-# TODO: Import two metrics from sklearn - fbeta_score and accuracy_score
-from sklearn.metrics import fbeta_score, accuracy_score
-
-def train_predict(learner, sample_size, X_train, y_train, X_test, y_test): 
-    '''
-    inputs:
-       - learner: the learning algorithm to be trained and predicted on
-       - sample_size: the size of samples (number) to be drawn from training set
-       - X_train: features training set
-       - y_train: income training set
-       - X_test: features testing set
-       - y_test: income testing set
-    '''
-    
-    results = {}
-    
-    # Fit the learner to the training data using slicing with 'sample_size' using .fit()
-    start = time() # Get start time
-    learner = learner.fit(X_train[:sample_size], y_train[:sample_size])
-    end = time() # Get end time
-    
-    # Calculate the training time
-    results['train_time'] = end - start
-        
-    # Get the predictions on the test set(X_test),
-    #       then get predictions on the first 300 training samples(X_train) using .predict()
-    start = time() # Get start time
-    predictions_test = learner.predict(X_test)
-    predictions_train = learner.predict(X_train[:300])
-    end = time() # Get end time
-    
-    # Calculate the total prediction time
-    results['pred_time'] = end - start
-            
-    # Compute accuracy on the first 300 training samples which is y_train[:300]
-    results['acc_train'] = accuracy_score(y_train[:300], predictions_train)
-        
-    # Compute accuracy on test set using accuracy_score()
-    results['acc_test'] = accuracy_score(y_test, predictions_test)
-    
-    # Compute F-score on the the first 300 training samples using fbeta_score()
-    results['f_train'] = fbeta_score(y_train[:300], predictions_train, beta = 0.5)
-        
-    # Compute F-score on the test set which is y_test
-    results['f_test'] = fbeta_score(y_test, predictions_test, beta = 0.5)
-       
-    # Success
-    print("{} trained on {} samples.".format(learner.__class__.__name__, sample_size))
-        
-    # Return the results
-    return results
-
-
-# ### Implementation: Initial Model Evaluation
-# 
-
-# In[12]:
-
-
-# Import the three supervised learning models from sklearn
-from sklearn.svm import SVC
+import scipy.sparse as sp
+from joblib import effective_n_jobs
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import SGDClassifier
-# Initialize the three models
-clf_A = SVC(random_state = 1)
-clf_B = RandomForestClassifier(random_state = 1)
-clf_C = SGDClassifier(random_state = 1)
-
-# Calculate the number of samples for 1%, 10%, and 100% of the training data
-samples_100 = len(y_train)
-samples_10 = int(samples_100 / 10)
-samples_1 = int(samples_100 / 100)
-
-# Collect results on the learners
-results = {}
-for clf in [clf_A, clf_B, clf_C]:
-    clf_name = clf.__class__.__name__
-    results[clf_name] = {}
-    for i, samples in enumerate([samples_1, samples_10, samples_100]):
-        results[clf_name][i] =         train_predict(clf, samples, X_train, y_train, X_test, y_test)
-
-# Run metrics visualization for the three supervised learning models chosen
-vs.evaluate(results, accuracy, fscore)
-
-
-# In[13]:
-
-
-results
-
-
-# ----
-# ## Improving Results
-
-# #### Choosing the Best Model Based on:
-# 
-# * metrics - F score on the testing when 100% of the training data is used, 
-# * prediction/training time
-# * the algorithm's suitability for the data.
-
-# #### both RandomForestClassifier and SGDClassifier have good fscore and accuracy in testing data but there's big differnce fscore&accuracy between trainning and testing data in the Random Forest and that may lead to overfitting, So I suggest SGDC Model.
-
-# ### Describing the Model in Layman's Terms
-# 
-
-# #### Dear CharityML,
-# 
-# First of all, I'm pleased to work in this project. It was a challenging project, so now I'll describe the process we did to make our predictor model.
-# 
-# We had made some analysis and visualization to better understand our data. then transform the numeric data to get better range, and made some transformation in the categorical date, furthermore we did split our data to trainning data and testing data to know the best model between the reccommended models we had chosen.
-# 
-# We got that SGDC Model the best one for our data because it had got the best accurracy - in the tranning and testing set - to predict the people who has more than 50K income. and the time consumption was good enough.
-
-# ### Implementation: Model Tuning
-
-# In[17]:
-
-
-# Import 'GridSearchCV', 'make_scorer', and any other necessary libraries
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import make_scorer
-# Initialize the classifier
-clf = SGDClassifier(random_state = 1)
-
-# Create the parameters list you wish to tune, using a dictionary if needed.
-# parameters = {'parameter_1': [value1, value2], 'parameter_2': [value1, value2]}
-parameters = {'penalty': ['l2', 'l1'],
-             'alpha': [.0001,.0003,.0005,.001,.005,.01,.015,0.1]}
-# Make an fbeta_score scoring object using make_scorer()
-scorer = make_scorer(fbeta_score, beta=0.5)
-
-# Perform grid search on the classifier using 'scorer' as the scoring method using GridSearchCV()
-grid_obj = GridSearchCV(clf, param_grid=parameters,scoring=scorer)
-
-# Fit the grid search object to the training data and find the optimal parameters using fit()
-grid_fit = grid_obj.fit(X_train, y_train)
-
-# Get the estimator
-best_clf = grid_fit.best_estimator_
-
-# Make predictions using the unoptimized and model
-predictions = (clf.fit(X_train, y_train)).predict(X_test)
-best_predictions = best_clf.predict(X_test)
-
-# Report the before-and-afterscores
-print("Unoptimized model\n------")
-print("Accuracy score on testing data: {:.4f}".format(accuracy_score(y_test, predictions)))
-print("F-score on testing data: {:.4f}".format(fbeta_score(y_test, predictions, beta = 0.5)))
-print("\nOptimized Model\n------")
-print("Final accuracy score on the testing data: {:.4f}".format(accuracy_score(y_test, best_predictions)))
-print("Final F-score on the testing data: {:.4f}".format(fbeta_score(y_test, best_predictions, beta = 0.5)))
-
-
-# #### Results:
-# 
-# |     Metric     | Unoptimized Model | Optimized Model |
-# | :------------: | :---------------: | :-------------: | 
-# | Accuracy Score |    83.97 %        |    84.09 %      |
-# | F-score        |    67.86 %        |    68.73 %      |
-# 
-
-# **The Optimized Model is better from the unoptimized model by almost 1% in F-score metric test (that means the optimized model can predict more true positives) and that's our goal to perfom a model has a good F-score (0.5 beta). Also the accurracy metric test is a little better in the optimized model.**
-
-# ----
-# ## Feature Importance
-# 
-# An important task when performing supervised learning on a dataset like the census data we study here is determining which features provide the most predictive power. By focusing on the relationship between only a few crucial features and the target label we simplify our understanding of the phenomenon, which is most always a useful thing to do. In the case of this project, that means we wish to identify a small number of features that most strongly predict whether an individual makes at most or more than \$50,000.
-# 
-# Choose a scikit-learn classifier (e.g., adaboost, random forests) that has a `feature_importance_` attribute, which is a function that ranks the importance of features according to the chosen classifier.  In the next python cell fit this classifier to training set and use this attribute to determine the top 5 most important features for the census dataset.
-
-# ### The Five Features that has higher correlation to the predictor income in my opinion:
-# 
-#   1. **Age**: Because the older you're the higher probability to have high position in companies.
-#     
-#     
-#   2. **Educational Level**: Because the more eduactional you take the more Responsibility you have towards society.
-#     
-#     
-#   3. **Occupation**: Because the hour salary for one who graduated from Engineering Faculty in usa not as like as one who                  graduated from Social Service Faculty in Egypt.
-#     
-#     
-#   4. **Hours-per-week**: Because the more you work the more you gain.
-#     
-#     
-#   5. **Capital Gain**: the more capital you gain the more capital you have.
-
-# ### Implementation - Extracting Feature Importance`.
-
-# In[18]:
-
-
-
-# TODO: Train the supervised model on the training set using .fit(X_train, y_train)
-model = RandomForestClassifier(random_state=1).fit(X_train,y_train)
+from sklearn.metrics import fbeta_score, make_scorer
+from sklearn.model_selection import train_test_split
+from sklearn.svm import SVC
 
-# TODO: Extract the feature importances using .feature_importances_ 
-importances = model.feature_importances_
+import cache
+import census
+from artifacts import ArtifactStore, DEFAULT_STORE_DIR
+from boosting import QuantileBinner, hist_gradient_boosting
+from instrument import Recorder
+from kernels import ApproxSVC, compare_svc
+from metrics import ConfusionCounts, best_threshold
+from training import (DEFAULT_BATCH_SIZE, StratifiedSampler, evaluate_minibatches,
+                      incremental_learning_curve, iter_csv_minibatches, iter_csv_rows,
+                      take_columns, take_rows, train_out_of_core, train_predict_many)
 
-# Plot
-import matplotlib.pyplot as plt
 
-vs.feature_plot(importances, X_train, y_train)
+# Default location of the stage outputs
+DEFAULT_WORK_DIR = ".stages"
 
+# Share of the rows held out for testing, and the seed of the split
+TEST_SIZE = 0.2
+SPLIT_SEED = 0
 
-# ### Question - Extracting Feature Importance
-# 
+# Share of the training rows held out to select features and cutoffs, so
+# that the testing set only measures the final models
+VALIDATION_SIZE = 0.2
 
-# --------------------------------
+# Every HOLDOUT_EVERY-th row of a streamed file is held out for testing
+HOLDOUT_EVERY = int(round(1 / TEST_SIZE))
 
-# **Answer**
-# * The feature importance predict the best five feature is (age, hours per week, capital-gain,    marital-status, relationship)
-# * But we Predict (age, educational level, occupation, hours per week, capital gain)
-# * So we have 3 right gusses (age, hours per week, capital gain) and thats because of this three is effecting directly the income money.
-# * But the data is saying the status of your heart is effecting your money and its a little              surprising :")
-#     
-#     
+# Grid of the SGDClassifier tuning
+PARAMETERS = {'penalty': ['l2', 'l1'],
+              'alpha': [.0001, .0003, .0005, .001, .005, .01, .015, 0.1]}
 
-# ### Feature Selection
-# 
+# Byte suffixes of the --memory-budget flag
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
 
-# In[19]:
 
+def parse_bytes(text):
+    """
+    Number of bytes of a size such as '512M' or '4G'
+    """
 
-# Import functionality for cloning a model
-from sklearn.base import clone
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
 
-# Reduce the feature space
-X_train_reduced = X_train[X_train.columns.values[(np.argsort(importances)[::-1])[:5]]]
-X_test_reduced = X_test[X_test.columns.values[(np.argsort(importances)[::-1])[:5]]]
 
-# Train on the "best" model found from grid search earlier
-clf = (clone(best_clf)).fit(X_train_reduced, y_train)
+def learners(data, exact_svc = True):
+    """
+    The learners compared by the 'train' stage, by name
 
-# Make new predictions
-reduced_predictions = clf.predict(X_test_reduced)
+    The exact SVC, whose cost grows superlinearly with the rows, can be left
+    out in favor of its linear-time approximation ApproxSVC.
+    """
 
-# Report scores from the final model using both versions of data
-print("Final Model trained on full data\n------")
-print("Accuracy on testing data: {:.4f}".format(accuracy_score(y_test, best_predictions)))
-print("F-score on testing data: {:.4f}".format(fbeta_score(y_test, best_predictions, beta = 0.5)))
-print("\nFinal Model trained on reduced data\n------")
-print("Accuracy on testing data: {:.4f}".format(accuracy_score(y_test, reduced_predictions)))
-print("F-score on testing data: {:.4f}".format(fbeta_score(y_test, reduced_predictions, beta = 0.5)))
+    candidates = {
+        'SVC': SVC(random_state = 1),
+        'ApproxSVC': ApproxSVC(random_state = 1),
+        'RandomForestClassifier': RandomForestClassifier(random_state = 1),
+        'SGDClassifier': SGDClassifier(random_state = 1),
+        'HistGradientBoostingClassifier': hist_gradient_boosting(data.binner, random_state = 1),
+    }
+    if not exact_svc:
+        del candidates['SVC']
+    return candidates
 
 
-# ### Effects of Feature Selection
+def inputs(data):
+    """
+    The features of the learners not trained on the encoded matrix, by name
+    """
 
-# -----------------------
+    return {'HistGradientBoostingClassifier': (data.codes_train, data.codes_test)}
 
-# **Results :**
-# 
-# |     Metric     | Full Data Model | Reduced Features Model |
-# | :------------: | :---------------: | :-------------: | 
-# | Accuracy Score |    84.09 %        |    80.25 %      |
-# | F-score        |    68.73 %        |    56.22 %      |
-# 
 
-# 1. The full data is better for predicting as we can see in the accuracy Score and F-Score.
-# 2. If time is a factor I'd reccommend to change the the model Algorithem not the features because all the features is important in some level.
+def fbeta_scorer():
+    return make_scorer(fbeta_score, beta = 0.5)
 
-# > **Note**: Once you have completed all of the code implementations and successfully answered each question above, you may finalize your work by exporting the iPython Notebook as an HTML document. You can do this by using the menu above and navigating to  
-# **File -> Download as -> HTML (.html)**. Include the finished document along with this notebook as your submission.
 
-# ## Before You Submit
-# You will also need run the following in order to convert the Jupyter notebook into HTML, so that your submission will include both files.
+def metrics(y_true, predictions):
+    counts = ConfusionCounts.from_predictions(y_true, predictions)
+    return {'accuracy': counts.accuracy(), 'fscore': counts.fbeta(beta = 0.5),
+            'precision': counts.precision(), 'recall': counts.recall()}
 
-# In[20]:
 
+def _default(value):
+    """
+    JSON encoding of the numpy values found in the stage outputs
+    """
 
-get_ipython().getoutput('jupyter nbconvert *.ipynb')
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("{} is not JSON serialisable.".format(value.__class__.__name__))
 
 
-# In[ ]:
+class Stages(object):
+    """
+    The JSON outputs of the stages under one directory, keyed by a hash of their inputs
 
+    inputs:
+      - directory: the directory holding one sub-directory per stage
+      - force: whether to recompute the outputs that already exist
+    """
+
+    def __init__(self, directory = DEFAULT_WORK_DIR, force = False):
+        self.directory = directory
+        self.force = force
+
+    def key(self, stage, **inputs):
+        blob = json.dumps(dict(inputs, stage = stage), sort_keys = True, default = _default)
+        return hashlib.blake2b(blob.encode('utf-8'), digest_size = 16).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, key + '.json')
+
+    def get(self, stage, key):
+        """
+        The output of a stage, None if missing or forced to rerun
+        """
+
+        if self.force or not os.path.exists(self._path(stage, key)):
+            return None
+        with open(self._path(stage, key)) as f:
+            return json.load(f)
+
+    def put(self, stage, key, output):
+        """
+        Write the output of a stage atomically, so an interrupted stage leaves no file
+        """
+
+        os.makedirs(os.path.join(self.directory, stage), exist_ok = True)
+        fd, scratch = tempfile.mkstemp(dir = os.path.join(self.directory, stage))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(output, f, indent = 2, default = _default)
+        os.replace(scratch, self._path(stage, key))
+        return output
+
+    def run(self, stage, key, compute):
+        """
+        The output of a stage, computed and written by 'compute()' if missing
+        """
+
+        output = self.get(stage, key)
+        if output is None:
+            output = self.put(stage, key, compute())
+        else:
+            print("{}: up to date ({})".format(stage, key))
+        return output
+
+
+class Dataset(object):
+    """
+    The encoded census data, split into training and testing sets
+
+    With a memory budget, the chunk size of the preprocessing, the number of
+    workers and the matrix format are chosen to stay within it: chunks hold
+    at most a quarter of the budget, the features are kept as a CSR matrix
+    (about 4.5 times smaller) if the dense training set would take more than
+    half of it, and every worker gets room for its own copy of the training set.
 
+    inputs:
+      - path: the census CSV file
+      - chunksize: the maximum number of rows per chunk of the preprocessing
+      - n_jobs: the maximum number of workers, -1 for all cores
+      - memory_budget: the number of bytes the pipeline should stay within, None for no limit
+      - sparse: whether to use a CSR matrix regardless of the budget
+      - skewed: the columns to log-transform, or 'auto' to pick them by their skewness
+    """
+
+    def __init__(self, path, chunksize = census.DEFAULT_CHUNKSIZE, n_jobs = None,
+                 memory_budget = None, sparse = False, skewed = census.SKEWED):
+        n_features = len(census.NUMERICAL) + sum(len(v) for v in census.CATEGORIES.values())
+        row_bytes = 4 * n_features
+        if memory_budget is not None:
+            chunksize = max(1000, min(chunksize, memory_budget // (4 * 4 * row_bytes)))
+
+        self.path = path
+        self.chunksize = chunksize
+        features, income, self.preprocessor, self.key = cache.load_features(
+            path, skewed = skewed, chunksize = chunksize, return_key = True)
+        self.features_cached, self.income_cached = features, income
+        self.feature_names = list(self.preprocessor.get_feature_names_out())
+
+        train, test = train_test_split(np.arange(len(income)), test_size = TEST_SIZE,
+                                       random_state = SPLIT_SEED)
+        self.train_rows, self.test_rows = train, test
+
+        train_bytes = len(train) * row_bytes
+        self.sparse = sparse or (memory_budget is not None and train_bytes > memory_budget // 2)
+        if self.sparse:
+            train_bytes //= 4
+            features = sp.vstack([sp.csr_matrix(features[start:start + chunksize])
+                                  for start in range(0, features.shape[0], chunksize)],
+                                 format = 'csr')
+        self.n_jobs = n_jobs
+        if memory_budget is not None:
+            room = max(1, memory_budget // max(train_bytes, 1) - 1)
+            self.n_jobs = int(min(effective_n_jobs(n_jobs), room))
+
+        self.X_train, self.X_test = take_rows(features, train), take_rows(features, test)
+        self.y_train, self.y_test = take_rows(income, train), take_rows(income, test)
+
+        # Bin codes of the boosting learner, binned once for every sample size and fold
+        self.binner = QuantileBinner.from_preprocessor(self.preprocessor).fit(self.X_train)
+        self.codes_train = self.binner.transform(self.X_train)
+        self.codes_test = self.binner.transform(self.X_test)
+        self._validation = None
+
+    def validation_split(self):
+        """
+        (X_fit, y_fit, X_val, y_val): the training set split again, stratified
+
+        The split is made on first use, as it copies the training set.
+        """
+
+        if self._validation is None:
+            fit, val = train_test_split(np.arange(len(self.y_train)), test_size = VALIDATION_SIZE,
+                                        stratify = self.y_train, random_state = SPLIT_SEED)
+            self._validation = (take_rows(self.X_train, fit), take_rows(self.y_train, fit),
+                                take_rows(self.X_train, val), take_rows(self.y_train, val))
+        return self._validation
+
+
+def prepare(stages, data):
+    """
+    Encode the census file into the feature cache and describe the data
+    """
+
+    def compute():
+        income = np.asarray(data.income_cached)
+        n_greater_50k = int(income.sum())
+        return {
+            'n_records': len(income),
+            'n_greater_50k': n_greater_50k,
+            'n_at_most_50k': len(income) - n_greater_50k,
+            'greater_percent': 100. * n_greater_50k / len(income),
+            'n_features': len(data.feature_names),
+            'n_train': len(data.train_rows),
+            'n_test': len(data.test_rows),
+        }
+
+    output = stages.run('prepare', stages.key('prepare', data = data.key), compute)
+    print("prepare: {n_records} records, {greater_percent:.2f}% above $50,000, "
+          "{n_features} features".format(**output))
+    return output
+
+
+def naive_predictor(y):
+    """
+    Accuracy and F-score of always predicting an income above $50,000
+    """
+
+    y = np.asarray(y)
+    return metrics(y, np.ones_like(y))
+
+
+def train(stages, data, recorder = None, plots = None, exact_svc = True, incremental = False):
+    """
+    Compare the learners on 1%, 10% and 100% of the training set
+
+    Every learner is a stage of its own, so only the missing ones are fitted.
+    With the exact SVC, the quality and cost of ApproxSVC relative to it are
+    reported at every size. With 'incremental' set, each learner is grown
+    through the sizes by incremental_learning_curve, one learner after the
+    other, instead of fitted from scratch at each size in parallel; its
+    'train_time' is then cumulative.
+    """
+
+    n = len(data.y_train)
+    sizes = [int(n / 100), int(n / 10), n]
+    keys = {name: stages.key('train', data = data.key, sparse = data.sparse,
+                             learner = repr(learner), sizes = sizes, incremental = incremental)
+            for name, learner in learners(data, exact_svc).items()}
+    results = {name: stages.get('train', key) for name, key in keys.items()}
+
+    missing = {name: learner for name, learner in learners(data, exact_svc).items()
+               if results[name] is None}
+    if not missing:
+        print("train: up to date")
+    elif incremental:
+        sampler = StratifiedSampler(data.y_train, 0)
+        features = inputs(data)
+        for name, learner in missing.items():
+            X_train, X_test = features.get(name, (data.X_train, data.X_test))
+            curve = incremental_learning_curve(learner, sizes, X_train, data.y_train, X_test,
+                                               data.y_test, sampler = sampler, recorder = recorder)
+            results[name] = stages.put('train', keys[name], curve)
+    else:
+        fitted = train_predict_many(missing, sizes, data.X_train, data.y_train, data.X_test,
+                                    data.y_test, n_jobs = data.n_jobs, recorder = recorder,
+                                    inputs = inputs(data))
+        for name in missing:
+            results[name] = stages.put('train', keys[name], fitted[name])
+
+    # JSON turned the size indices into strings
+    results = {name: {int(i): r for i, r in curve.items()} for name, curve in results.items()}
+    naive = naive_predictor(data.y_test)
+    for name, curve in results.items():
+        print("train: {:<32} F-score {:.4f} on the testing set".format(name, curve[2]['f_test']))
+    if exact_svc:
+        for row, size in zip(compare_svc(results), sizes):
+            print("train: ApproxSVC vs SVC on {} samples: accuracy {:+.4f}, F-score {:+.4f}, "
+                  "fit speed-up x{:.1f}, predict speed-up x{:.1f}"
+                  .format(size, row['acc_diff'], row['f_diff'], row['train_speedup'],
+                          row['pred_speedup']))
+    if plots is not None:
+        import visuals as vs
+        os.makedirs(plots, exist_ok = True)
+        vs.evaluate(results, naive['accuracy'], naive['fscore'],
+                    None if recorder is None else recorder.records,
+                    path = os.path.join(plots, 'evaluate.png'))
+    return results
 
 
+def tune(stages, data, store, search = 'halving', time_budget = None):
+    """
+    Tune SGDClassifier for the F-score and save the best model as 'best_clf'
+    """
+
+    from tuning import MemoizedGridSearch, SuccessiveHalvingSearch
+
+    def compute():
+        clf = SGDClassifier(random_state = 1)
+        fit_cache = cache.FitCache()
+        if search == 'halving':
+            grid_obj = SuccessiveHalvingSearch(clf, PARAMETERS, fbeta_scorer(),
+                                               n_jobs = data.n_jobs, time_budget = time_budget,
+                                               cache = fit_cache)
+        else:
+            grid_obj = MemoizedGridSearch(clf, PARAMETERS, fbeta_scorer(), n_jobs = data.n_jobs,
+                                          cache = fit_cache)
+        grid_fit = grid_obj.fit(data.X_train, data.y_train)
+        best_clf = grid_fit.best_estimator_
+
+        unoptimized = metrics(data.y_test, clone(clf).fit(data.X_train, data.y_train)
+                              .predict(data.X_test))
+        optimized = metrics(data.y_test, best_clf.predict(data.X_test))
+        version = store.save('best_clf', best_clf, data.preprocessor, data.feature_names,
+                             optimized, best_params = grid_fit.best_params_)
+        return {'version': version, 'best_params': grid_fit.best_params_,
+                'unoptimized': unoptimized, 'optimized': optimized}
+
+    key = stages.key('tune', data = data.key, sparse = data.sparse, parameters = PARAMETERS,
+                     search = search, time_budget = time_budget,
+                     store = os.path.abspath(store.root))
+    output = stages.run('tune', key, compute)
+    print("tune: best_clf version {version}, {best_params}, F-score {:.4f} (unoptimized {:.4f})"
+          .format(output['optimized']['fscore'], output['unoptimized']['fscore'], **output))
+    return output
+
+
+def reduce(stages, data, store, tuned, plots = None, max_latency = None):
+    """
+    Refit best_clf on its most important features and save the result as 'reduced_clf'
+
+    A clone of best_clf is fitted on the training set minus a validation
+    split, and the features are ranked by its permutation importance on that
+    split. Every candidate set is refitted the same way and scored on the
+    split: the smallest set within one point of the full feature set's
+    validation F-score, and predicting within 'max_latency' seconds per row
+    if set, is kept, or the top five features if there is none.
+    Only the refit of the chosen set on the whole training set is scored on
+    the testing set. The validation scores of the full and chosen fits also
+    give the F-score maximizing cutoffs of best_clf and reduced_clf, which
+    the 'threshold' stage applies, without any further fit.
+    """
+
+    from importance import feature_groups, permutation_importance
+    from selection import (candidate_feature_sets, decision_scores, evaluate_feature_sets,
+                           select_feature_set)
+
+    def compute():
+        best_clf = store.load('best_clf', tuned['version']).model
+        X_fit, y_fit, X_val, y_val = data.validation_split()
+        ranker = clone(best_clf).fit(X_fit, y_fit)
+        importances = permutation_importance(ranker, X_val, y_val, scorer = fbeta_scorer(),
+                                             n_jobs = data.n_jobs)
+        fields = permutation_importance(ranker, X_val, y_val, scorer = fbeta_scorer(),
+                                        groups = feature_groups(data.preprocessor),
+                                        n_jobs = data.n_jobs)
+        if plots is not None:
+            import visuals as vs
+            os.makedirs(plots, exist_ok = True)
+            vs.feature_plot(fields['importances_mean'], fields['names'], data.y_train,
+                            path = os.path.join(plots, 'feature_importance.png'))
+
+        feature_sets = candidate_feature_sets(importances['importances_mean'],
+                                              ks = [5, 10, 20, 40],
+                                              thresholds = [0.8, 0.9, 0.95, 0.99])
+        full = metrics(y_val, ranker.predict(X_val))
+        full_scores = decision_scores(ranker, X_val)
+        reports = evaluate_feature_sets(best_clf, feature_sets, X_fit, y_fit, X_val, y_val,
+                                        n_jobs = data.n_jobs)
+        chosen = select_feature_set(reports, min_fscore = full['fscore'] - 0.01,
+                                    max_latency = max_latency)
+        if chosen is None:
+            chosen = next(report for report in reports if report['name'] == 'top_5')
+
+        columns = chosen['columns']
+        clf = clone(best_clf).fit(take_columns(data.X_train, columns), data.y_train)
+        reduced = metrics(data.y_test, clf.predict(take_columns(data.X_test, columns)))
+        version = store.save('reduced_clf', clf, data.preprocessor,
+                             [data.feature_names[j] for j in columns], reduced,
+                             feature_set = chosen['name'])
+
+        cutoffs = {}
+        for name, scores in (('best_clf', full_scores), ('reduced_clf', chosen['scores'])):
+            cutoff, counts = best_threshold(y_val, scores, beta = 0.5)
+            cutoffs[name] = {'threshold': cutoff, 'validation_fscore': counts.fbeta(beta = 0.5)}
+        return {'version': version, 'feature_set': chosen['name'], 'k': chosen['k'],
+                'reduced': reduced, 'validation_fscore': chosen['fscore'],
+                'full_validation_fscore': full['fscore'], 'thresholds': cutoffs,
+                'importances': dict(zip(fields['names'], fields['importances_mean'])),
+                'reports': [{k: v for k, v in report.items() if k not in ('columns', 'scores')}
+                            for report in reports]}
+
+    key = stages.key('reduce', data = data.key, sparse = data.sparse, tuned = tuned,
+                     validation = VALIDATION_SIZE, ranked_on = 'validation',
+                     max_latency = max_latency, thresholds = 'validation',
+                     store = os.path.abspath(store.root))
+    output = stages.run('reduce', key, compute)
+    print("reduce: reduced_clf version {version}, {feature_set} ({k} features), "
+          "F-score {:.4f} (validation {validation_fscore:.4f})"
+          .format(output['reduced']['fscore'], **output))
+    return output
+
+
+def threshold(stages, data, store, name, version, reduced):
+    """
+    Save a model with the F-score maximizing decision threshold as a new version
+
+    The cutoff is the one the 'reduce' stage swept (metrics.best_threshold)
+    over the validation scores of the same parameters and features fitted
+    without the validation split, as the in-sample scores of the model itself
+    are overconfident; no model is fitted here. The testing set only measures
+    the result. The new version keeps the model and adds the cutoff to its
+    metadata, which Scorer uses in place of 0 or 0.5.
+    """
+
+    from serving import Scorer
+
+    tuned_on = reduced['thresholds'][name]
+
+    def compute():
+        artifact = store.load(name, version)
+        scorer = Scorer(data.preprocessor, artifact.model, artifact.features)
+        cutoff = tuned_on['threshold']
+        scores_test = scorer.decision_scores(data.X_test)
+        default = metrics(data.y_test, scores_test > scorer.threshold)
+        tuned = metrics(data.y_test, scores_test > cutoff)
+        new_version = store.save(name, artifact.model, artifact.preprocessor, artifact.features,
+                                 tuned, **dict(artifact.metadata, threshold = cutoff,
+                                               threshold_of = version))
+        return {'version': new_version, 'threshold': cutoff, 'default_threshold': scorer.threshold,
+                'validation_fscore': tuned_on['validation_fscore'], 'default': default,
+                'tuned': tuned}
+
+    key = stages.key('threshold', data = data.key, sparse = data.sparse, model = name,
+                     version = version, threshold = tuned_on['threshold'], scores = 'validation',
+                     store = os.path.abspath(store.root))
+    output = stages.run('threshold', key, compute)
+    print("threshold: {} version {version}, threshold {threshold:.4f}, F-score {:.4f} "
+          "(at {default_threshold:g}: {:.4f})"
+          .format(name, output['tuned']['fscore'], output['default']['fscore'], **output))
+    return output
+
+
+def stream(stages, store, path, model = 'best_clf', version = None,
+           chunksize = census.DEFAULT_CHUNKSIZE, n_epochs = 5, batch_size = DEFAULT_BATCH_SIZE):
+    """
+    Train a saved model's parameters out of core on a census file, saved as 'streamed_clf'
+
+    For extracts too large for the feature cache: the file is only ever read
+    one chunk at a time. Every HOLDOUT_EVERY-th row is held out. A new
+    preprocessor is fitted on the other rows in one pass, then a clone of the
+    model (keeping its tuned parameters) is trained on them with partial_fit
+    for 'n_epochs' passes, and scored on the held-out rows from their
+    confusion counts.
+    """
+
+    from preprocessing import CensusPreprocessor
+
+    version = version or store.latest(model)
+    key = stages.key('stream', data = cache.file_digest(path), model = model, version = version,
+                     n_epochs = n_epochs, batch_size = batch_size, holdout = HOLDOUT_EVERY,
+                     store = os.path.abspath(store.root))
+
+    def compute():
+        artifact = store.load(model, version)
+        preprocessor = CensusPreprocessor(census.SKEWED, census.NUMERICAL, None,
+                                          census.CATEGORIES)
+        for features_raw, _ in iter_csv_rows(path, chunksize, HOLDOUT_EVERY):
+            preprocessor.partial_fit(features_raw)
+        names = list(preprocessor.get_feature_names_out())
+        columns = np.array([names.index(f) for f in artifact.features or names])
+
+        def minibatches(random_state, holdout = False):
+            for X, y in iter_csv_minibatches(path, preprocessor, batch_size, chunksize,
+                                             random_state, HOLDOUT_EVERY, holdout):
+                yield take_columns(X, columns), y
+
+        clf = train_out_of_core(artifact.model, lambda epoch, seed: minibatches(seed),
+                                n_epochs = n_epochs)
+        counts = evaluate_minibatches(clf, minibatches(0, holdout = True))
+        streamed = counts.scores(beta = 0.5)
+        new_version = store.save('streamed_clf', clf, preprocessor,
+                                 [names[j] for j in columns],
+                                 {k: streamed[k] for k in ('accuracy', 'fscore', 'precision',
+                                                           'recall')},
+                                 trained_from = [model, version], n_epochs = n_epochs)
+        return {'version': new_version, 'model': model, 'n_holdout': counts.total,
+                'streamed': streamed}
+
+    output = stages.run('stream', key, compute)
+    print("stream: streamed_clf version {version}, {model} parameters, F-score {:.4f} "
+          "on {n_holdout} held-out records".format(output['streamed']['fscore'], **output))
+    return output
+
+
+def score(stages, store, path, output, model = 'best_clf', version = None,
+          chunksize = census.DEFAULT_CHUNKSIZE):
+    """
+    Write the predictions and scores of a saved model for every record of a census file
+
+    The file is scored one chunk at a time into 'output' (CSV with the
+    'prediction' and 'score' columns), which is replaced atomically once complete.
+    When the file has the income column, the exact scores of the model are
+    aggregated from the confusion counts of every chunk.
+    """
+
+    from serving import Scorer
+
+    version = version or store.latest(model)
+    key = stages.key('score', data = cache.file_digest(path), model = model, version = version,
+                     store = os.path.abspath(store.root), output = os.path.abspath(output))
+    done = stages.get('score', key)
+    if done is not None and os.path.exists(output):
+        print("score: up to date ({})".format(key))
+        return done
+
+    scorer = Scorer.from_store(store, model, version)
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, scratch = tempfile.mkstemp(dir = directory)
+    n_records = n_positive = 0
+    counts = ConfusionCounts()
+    with os.fdopen(fd, 'w') as f:
+        f.write("prediction,score\n")
+        for chunk in census.read_census(path, chunksize):
+            predictions, scores = scorer.predict(chunk.drop(census.TARGET, axis = 1,
+                                                            errors = 'ignore'))
+            np.savetxt(f, np.column_stack([predictions, scores]), fmt = ['%d', '%.6g'],
+                       delimiter = ',')
+            n_records += len(predictions)
+            n_positive += int(np.sum(predictions))
+            if census.TARGET in chunk:
+                counts.update(census.split_features(chunk)[1], predictions)
+    os.replace(scratch, output)
+
+    print("score: {} records, {} predicted above $50,000, written to {}"
+          .format(n_records, n_positive, output))
+    result = {'model': model, 'version': version, 'output': output,
+              'n_records': n_records, 'n_positive': n_positive}
+    if counts.total:
+        result['scores'] = counts.scores(beta = 0.5)
+        print("score: accuracy {accuracy:.4f}, F-score {fscore:.4f}".format(**result['scores']))
+    return stages.put('score', key, result)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Run the finding_donors pipeline.")
+    parser.add_argument('command', choices = ['prepare', 'train', 'tune', 'reduce', 'threshold',
+                                              'all', 'score', 'stream', 'bench'])
+    parser.add_argument('input', nargs = '?',
+                        help = "census file to score, or to stream ('stream', --data by default)")
+    parser.add_argument('--data', default = "census.csv", help = "census training file")
+    parser.add_argument('--workdir', default = DEFAULT_WORK_DIR,
+                        help = "directory of the stage outputs")
+    parser.add_argument('--store', default = DEFAULT_STORE_DIR,
+                        help = "artifact store directory")
+    parser.add_argument('--force', action = 'store_true', help = "rerun up-to-date stages")
+    parser.add_argument('--n-jobs', type = int, default = -1,
+                        help = "maximum number of worker processes, -1 for all cores")
+    parser.add_argument('--chunksize', type = int, default = census.DEFAULT_CHUNKSIZE,
+                        help = "maximum rows per chunk read from the census files")
+    parser.add_argument('--memory-budget', type = parse_bytes, default = None,
+                        help = "memory to stay within, e.g. 4G; sets the chunk size, "
+                               "the number of workers and the matrix format")
+    parser.add_argument('--auto-skew', action = 'store_true',
+                        help = "log-transform the numerical columns found skewed in the data "
+                               "instead of capital-gain and capital-loss")
+    parser.add_argument('--sparse', action = 'store_true',
+                        help = "train on a CSR matrix of the features")
+    parser.add_argument('--incremental', action = 'store_true',
+                        help = "grow every learner through the 'train' sizes instead of "
+                               "refitting it at each size")
+    parser.add_argument('--skip-exact-svc', action = 'store_true',
+                        help = "compare ApproxSVC alone, without the exact SVC")
+    parser.add_argument('--search', choices = ['halving', 'grid'], default = 'halving',
+                        help = "tuning strategy")
+    parser.add_argument('--time-budget', type = float, default = None,
+                        help = "seconds after which the halving search stops")
+    parser.add_argument('--phases', default = None,
+                        help = "JSON lines file of the 'train' phase timings and memory")
+    parser.add_argument('--latency-budget', type = float, default = None,
+                        help = "seconds per row within which the 'reduce' feature set "
+                               "must predict")
+    parser.add_argument('--plots', default = None, help = "directory to save the figures to")
+    parser.add_argument('--model', default = 'best_clf', help = "model to score with")
+    parser.add_argument('--version', type = int, default = None,
+                        help = "model version to score with")
+    parser.add_argument('--output', default = "predictions.csv", help = "predictions file")
+    parser.add_argument('--epochs', type = int, default = 5,
+                        help = "passes over the file of 'stream'")
+    parser.add_argument('--batch-size', type = int, default = DEFAULT_BATCH_SIZE,
+                        help = "rows per minibatch of 'stream'")
+
+    # 'bench' hands all its arguments to bench.py
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['bench']:
+        import bench
+        return bench.main([arg for arg in argv[1:] if arg != '--'])
+    args = parser.parse_args(argv)
+
+    stages = Stages(args.workdir, args.force)
+    store = ArtifactStore(args.store)
+    if args.command == 'score':
+        if args.input is None:
+            parser.error("'score' needs the census file to score")
+        score(stages, store, args.input, args.output, args.model, args.version, args.chunksize)
+        return 0
+    if args.command == 'stream':
+        stream(stages, store, args.input or args.data, args.model, args.version, args.chunksize,
+               args.epochs, args.batch_size)
+        return 0
+
+    data = Dataset(args.data, args.chunksize, args.n_jobs, args.memory_budget, args.sparse,
+                   'auto' if args.auto_skew else census.SKEWED)
+    if args.command in ('prepare', 'all'):
+        prepare(stages, data)
+    if args.command in ('train', 'all'):
+        recorder = None if args.phases is None else Recorder(args.phases, trace_memory = True)
+        train(stages, data, recorder, args.plots, not args.skip_exact_svc, args.incremental)
+    if args.command in ('tune', 'reduce', 'threshold', 'all'):
+        tuned = tune(stages, data, store, args.search, args.time_budget)
+        if args.command in ('reduce', 'threshold', 'all'):
+            reduced = reduce(stages, data, store, tuned, args.plots, args.latency_budget)
+        if args.command in ('threshold', 'all'):
+            threshold(stages, data, store, 'best_clf', tuned['version'], reduced)
+            threshold(stages, data, store, 'reduced_clf', reduced['version'], reduced)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Permutation importance of any fitted finding_donors model.
+
+The importance of a feature is the drop of the model's score when the
+feature's values are shuffled across rows. The one-hot columns of a census
+field are shuffled together, so each field gets one importance and the
+shuffled rows stay valid one-hot encodings.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.metrics import fbeta_score, make_scorer
+
+
+def feature_groups(preprocessor):
+    """
+    (name, column indices) of every census field in a fitted CensusPreprocessor output
+    """
+
+    groups = [(name, np.array([j])) for j, name in enumerate(preprocessor.numerical)]
+    for column in preprocessor.categorical_:
+        offset = preprocessor.offsets_[column]
+        groups.append((column, np.arange(offset, offset + len(preprocessor.categories_[column]))))
+    return groups
+
+
+def _score_groups(model, X, y, scorer, groups, seeds):
+    """
+    Score drops of a batch of groups, shuffling them in place in one private copy of X
+    """
+
+    buffer = np.array(X, order = 'F')
+    baseline = scorer(model, buffer, y)
+    drops = np.empty(seeds.shape)
+    for g, (name, columns) in enumerate(groups):
+        original = np.array(buffer[:, columns])
+        for r, seed in enumerate(seeds[g]):
+            permutation = np.random.RandomState(seed).permutation(len(buffer))
+            buffer[:, columns] = original[permutation]
+            drops[g, r] = baseline - scorer(model, buffer, y)
+        buffer[:, columns] = original
+    return drops
+
+
+def permutation_importance(model, X, y, scorer = None, groups = None, n_repeats = 5,
+                           n_jobs = None, backend = 'threading', random_state = 0):
+    """
+    Permutation importance of the features (or feature groups) of a fitted model
+
+    The groups are split in one batch per worker, and each batch shuffles
+    its groups in place in a single preallocated copy of X, restoring each
+    group once its repeats are done. Every (group, repeat) permutation has
+    its own seed, so the result does not depend on the number of workers.
+
+    inputs:
+      - model: any fitted model, e.g. best_clf
+      - X, y: the data to score on, held out from the model's training data; a
+        validation split rather than X_test when the ranking drives model selection
+      - scorer: a scorer; make_scorer(fbeta_score, beta=0.5) if None
+      - groups: (name, column indices) pairs such as feature_groups(preprocessor);
+        every column on its own, named after the DataFrame columns, if None
+      - n_repeats: the number of shuffles per group
+      - n_jobs: the number of workers, -1 for all cores
+      - backend: the joblib backend, 'threading' to share X or 'loky' for processes
+      - random_state: the seed of the shuffles
+
+    returns a dict with the group 'names', their 'importances_mean',
+    'importances_std', the raw 'importances' (one row per group) and the
+    'baseline' score, ready for vs.feature_plot(importances_mean, names, y)
+    """
+
+    if scorer is None:
+        scorer = make_scorer(fbeta_score, beta = 0.5)
+    if groups is None:
+        names = getattr(X, 'columns', range(X.shape[1]))
+        groups = [(str(name), np.array([j])) for j, name in enumerate(names)]
+    X = X.toarray() if sp.issparse(X) else np.asarray(X)
+    y = np.asarray(y)
+
+    seeds = np.random.RandomState(random_state).randint(np.iinfo(np.int32).max,
+                                                        size = (len(groups), n_repeats))
+    batches = np.array_split(np.arange(len(groups)), min(effective_n_jobs(n_jobs), len(groups)))
+    outputs = Parallel(n_jobs = n_jobs, backend = backend)(
+        delayed(_score_groups)(model, X, y, scorer, [groups[g] for g in batch], seeds[batch])
+        for batch in batches)
+
+    importances = np.vstack(outputs)
+    return {
+        'names': np.array([name for name, _ in groups], dtype = object),
+        'importances': importances,
+        'importances_mean': importances.mean(axis = 1),
+        'importances_std': importances.std(axis = 1),
+        'baseline': scorer(model, X, y),
+    }
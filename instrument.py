@@ -0,0 +1,105 @@
+"""
+Per-phase instrumentation of the training and prediction hot paths.
+
+A Recorder times named phases with perf_counter_ns and process_time_ns, and
+optionally tracks their tracemalloc peak and peak RSS growth. Every phase is
+kept as a flat dict record and can be appended to a JSON lines file.
+"""
+
+import json
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter_ns, process_time_ns
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process so far, in kilobytes (None where unsupported)
+    """
+
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Recorder(object):
+    """
+    Collects one structured record per timed phase
+
+    Each record holds the phase name, any extra fields passed to 'phase',
+    'wall_ns', 'cpu_ns', the per-row 'latency_ns' when 'rows' is given, and
+    with 'trace_memory' set the 'tracemalloc_peak_bytes' allocated above the
+    phase start and the 'rss_peak_growth_kb' of the process peak RSS.
+    Phases should not be nested when tracing memory, as they share the
+    tracemalloc peak.
+
+    inputs:
+      - path: a JSON lines file every record is appended to, None to keep them in memory only
+      - trace_memory: whether to trace memory, which slows allocations down
+    """
+
+    def __init__(self, path = None, trace_memory = False):
+        self.path = path
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def emit(self, record):
+        """
+        Keep a record and append it to the JSON lines file
+        """
+
+        self.records.append(record)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def extend(self, records):
+        """
+        Emit records collected by another Recorder, e.g. in a worker process
+        """
+
+        for record in records:
+            self.emit(record)
+
+    @contextmanager
+    def phase(self, name, rows = None, **fields):
+        """
+        Time the enclosed block as phase 'name'; yields the record, emitted on exit
+        """
+
+        record = dict(fields, phase = name)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+            rss_start = peak_rss_kb()
+        cpu_start = process_time_ns()
+        wall_start = perf_counter_ns()
+
+        yield record
+
+        record['wall_ns'] = perf_counter_ns() - wall_start
+        record['cpu_ns'] = process_time_ns() - cpu_start
+        if rows:
+            record['rows'] = rows
+            record['latency_ns'] = record['wall_ns'] / float(rows)
+        if self.trace_memory:
+            record['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1] - memory_start
+            if rss_start is not None:
+                record['rss_peak_growth_kb'] = peak_rss_kb() - rss_start
+        self.emit(record)
+
+
+def load_records(path):
+    """
+    Read back the records of a JSON lines file
+    """
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,145 @@
+"""
+Approximate kernel SVC for training sets too large for the exact SVC.
+
+The exact SVC fits in between quadratic and cubic time in the number of
+samples, and predicts in time linear in its number of support vectors.
+ApproxSVC maps the features through a fixed-size approximation of the RBF
+kernel (Nystroem landmarks or random Fourier features) and fits a linear SVM
+on the mapped features with SGD, so that both fitting and predicting are
+linear in the number of rows.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import SGDClassifier
+from sklearn.svm import SVC
+
+
+class ApproxSVC(BaseEstimator, ClassifierMixin):
+    """
+    RBF kernel SVC approximated by a kernel map and a linear SGD hinge model
+
+    It has the interface of SVC (C, kernel, gamma, random_state, fit,
+    predict, decision_function, classes_), so it can replace it in
+    train_predict. The SGD regularisation alpha = 1 / (C * n_samples) makes
+    the linear objective that of SVC on the mapped features.
+
+    inputs:
+      - C: the SVC regularisation parameter
+      - kernel: the kernel; 'rbf', or any kernel of Nystroem with approximation='nystroem'
+      - gamma: the kernel coefficient, 'scale' as in SVC, or a float
+      - approximation: 'nystroem', 'rff' (random Fourier features) or 'exact'
+      - n_components: the dimension of the kernel map
+      - exact_max_samples: training sets up to this many rows are fitted with
+        the exact SVC instead, 0 to always approximate
+      - max_iter, tol: the SGD stopping criteria
+      - random_state: the seed of the kernel map and of SGD
+    """
+
+    def __init__(self, C = 1.0, kernel = 'rbf', gamma = 'scale', approximation = 'nystroem',
+                 n_components = 500, exact_max_samples = 0, max_iter = 1000, tol = 1e-3,
+                 random_state = None):
+        self.C = C
+        self.kernel = kernel
+        self.gamma = gamma
+        self.approximation = approximation
+        self.n_components = n_components
+        self.exact_max_samples = exact_max_samples
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def _gamma(self, X):
+        """
+        The kernel coefficient, with 'scale' resolved as SVC does: 1 / (n_features * X.var())
+        """
+
+        if self.gamma != 'scale':
+            return float(self.gamma)
+        if sp.issparse(X):
+            variance = X.multiply(X).mean() - X.mean() ** 2
+        else:
+            variance = np.asarray(X, dtype = np.float64).var()
+        return 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+
+    def fit(self, X, y):
+        """
+        Fit the kernel map and the linear model, or the exact SVC for small training sets
+        """
+
+        n_samples = X.shape[0]
+        gamma = self._gamma(X)
+        self.gamma_ = gamma
+        if self.approximation == 'exact' or n_samples <= self.exact_max_samples:
+            self.mode_ = 'exact'
+            self.svc_ = SVC(C = self.C, kernel = self.kernel, gamma = gamma,
+                            random_state = self.random_state).fit(X, y)
+            self.classes_ = self.svc_.classes_
+            return self
+
+        if self.approximation == 'nystroem':
+            self.transformer_ = Nystroem(self.kernel, gamma = gamma,
+                                         n_components = min(self.n_components, n_samples),
+                                         random_state = self.random_state)
+        elif self.approximation == 'rff':
+            if self.kernel != 'rbf':
+                raise ValueError("Random Fourier features only approximate the 'rbf' kernel.")
+            self.transformer_ = RBFSampler(gamma = gamma, n_components = self.n_components,
+                                           random_state = self.random_state)
+        else:
+            raise ValueError("Unknown approximation '{}'.".format(self.approximation))
+
+        self.mode_ = self.approximation
+        features = self.transformer_.fit_transform(X).astype(np.float32, copy = False)
+        self.linear_ = SGDClassifier(loss = 'hinge', alpha = 1.0 / (self.C * n_samples),
+                                     max_iter = self.max_iter, tol = self.tol,
+                                     random_state = self.random_state).fit(features, y)
+        self.classes_ = self.linear_.classes_
+        return self
+
+    def decision_function(self, X):
+        """
+        Signed distance of the samples to the (approximate) separating hyperplane
+        """
+
+        if self.mode_ == 'exact':
+            return self.svc_.decision_function(X)
+        features = self.transformer_.transform(X).astype(np.float32, copy = False)
+        return self.linear_.decision_function(features)
+
+    def predict(self, X):
+        """
+        Predicted classes of the samples
+        """
+
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+def compare_svc(results, exact = 'SVC', approximate = 'ApproxSVC'):
+    """
+    Quality and cost of the approximate SVC relative to the exact one, per sample size
+
+    inputs:
+      - results: the output of train_predict_many with both learners
+      - exact, approximate: the names of the two learners in 'results'
+
+    returns one dict per size index with the test accuracy and F-score of
+    both learners, their differences (approximate minus exact) and the
+    training and prediction speed-ups of the approximation
+    """
+
+    rows = []
+    for i in sorted(results[exact]):
+        e, a = results[exact][i], results[approximate][i]
+        rows.append({
+            'size_index': i,
+            'acc_exact': e['acc_test'], 'acc_approx': a['acc_test'],
+            'acc_diff': a['acc_test'] - e['acc_test'],
+            'f_exact': e['f_test'], 'f_approx': a['f_test'],
+            'f_diff': a['f_test'] - e['f_test'],
+            'train_speedup': e['train_time'] / max(a['train_time'], 1e-9),
+            'pred_speedup': e['pred_time'] / max(a['pred_time'], 1e-9),
+        })
+    return rows
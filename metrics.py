@@ -0,0 +1,160 @@
+"""
+Confusion-matrix metrics of the binary income predictions.
+
+Every score used in finding_donors (accuracy, precision, recall, F-beta)
+derives from the four confusion counts, which one bincount pass computes for
+any number of subsets at once. Counts add up, so chunks of a stream or the
+outputs of parallel workers are scored exactly by summing their counts,
+without gathering the predictions.
+"""
+
+import numpy as np
+
+
+class ConfusionCounts(object):
+    """
+    True/false negative/positive counts of binary 0/1 predictions
+
+    inputs:
+      - tn, fp, fn, tp: the initial counts
+    """
+
+    def __init__(self, tn = 0, fp = 0, fn = 0, tp = 0):
+        self.tn, self.fp, self.fn, self.tp = int(tn), int(fp), int(fn), int(tp)
+
+    @classmethod
+    def from_predictions(cls, y_true, y_pred):
+        """
+        Counts of one set of labels and predictions
+        """
+
+        return cls(*np.bincount(_cells(y_true, y_pred), minlength = 4))
+
+    def update(self, y_true, y_pred):
+        """
+        Add the counts of another chunk of labels and predictions, in place
+        """
+
+        tn, fp, fn, tp = np.bincount(_cells(y_true, y_pred), minlength = 4)
+        self.tn += int(tn)
+        self.fp += int(fp)
+        self.fn += int(fn)
+        self.tp += int(tp)
+        return self
+
+    def __add__(self, other):
+        return ConfusionCounts(self.tn + other.tn, self.fp + other.fp, self.fn + other.fn,
+                               self.tp + other.tp)
+
+    def __radd__(self, other):
+        # Lets sum() start from 0
+        return self if other == 0 else self + other
+
+    def __eq__(self, other):
+        return isinstance(other, ConfusionCounts) and self.counts() == other.counts()
+
+    def __repr__(self):
+        return "ConfusionCounts(tn={}, fp={}, fn={}, tp={})".format(*self.counts())
+
+    def counts(self):
+        return (self.tn, self.fp, self.fn, self.tp)
+
+    @property
+    def total(self):
+        return self.tn + self.fp + self.fn + self.tp
+
+    def accuracy(self):
+        return (self.tp + self.tn) / float(self.total) if self.total else 0.0
+
+    def precision(self):
+        predicted = self.tp + self.fp
+        return self.tp / float(predicted) if predicted else 0.0
+
+    def recall(self):
+        actual = self.tp + self.fn
+        return self.tp / float(actual) if actual else 0.0
+
+    def fbeta(self, beta = 0.5):
+        """
+        F-beta score, 0 when there are no true positives, as fbeta_score
+        """
+
+        weight = beta ** 2
+        denominator = (1 + weight) * self.tp + weight * self.fn + self.fp
+        return (1 + weight) * self.tp / float(denominator) if denominator else 0.0
+
+    def scores(self, beta = 0.5):
+        """
+        The counts and every score as a dict
+        """
+
+        return {'tn': self.tn, 'fp': self.fp, 'fn': self.fn, 'tp': self.tp,
+                'accuracy': self.accuracy(), 'precision': self.precision(),
+                'recall': self.recall(), 'fscore': self.fbeta(beta)}
+
+
+def _cells(y_true, y_pred):
+    """
+    Confusion cell of every prediction: 2 * label + prediction
+    """
+
+    return 2 * np.asarray(y_true, dtype = np.intp) + np.asarray(y_pred, dtype = np.intp)
+
+
+def confusion_by_subset(y_true, y_pred, subsets, n_subsets = None):
+    """
+    ConfusionCounts of several subsets of predictions in one bincount pass
+
+    inputs:
+      - y_true, y_pred: the 0/1 labels and predictions of every subset, concatenated
+      - subsets: the subset index of every prediction
+      - n_subsets: the number of subsets, max(subsets) + 1 if None
+
+    returns a list of one ConfusionCounts per subset
+    """
+
+    subsets = np.asarray(subsets, dtype = np.intp)
+    if n_subsets is None:
+        n_subsets = int(subsets.max()) + 1 if len(subsets) else 0
+    cells = np.bincount(4 * subsets + _cells(y_true, y_pred), minlength = 4 * n_subsets)
+    return [ConfusionCounts(*cells[4 * s:4 * s + 4]) for s in range(n_subsets)]
+
+
+def best_threshold(y_true, scores, beta = 0.5):
+    """
+    Decision threshold maximizing the F-beta score of 'scores > threshold'
+
+    All thresholds are swept in one pass: the samples are sorted by
+    decreasing score once, and the true and false positive counts of every
+    cutoff are the cumulative sums of the sorted labels. Only cutoffs between
+    two distinct scores are candidates, so tied samples are never split.
+
+    inputs:
+      - y_true: the 0/1 labels
+      - scores: the decision_function or positive class probability of every sample
+      - beta: the weight of recall in the F-score
+
+    returns the threshold, halfway between the lowest selected score and
+    the next one, and the ConfusionCounts of the predictions it makes
+    """
+
+    y_true = np.asarray(y_true, dtype = np.intp)
+    scores = np.asarray(scores, dtype = np.float64)
+    if len(scores) == 0:
+        raise ValueError("best_threshold needs at least one sample.")
+    order = np.argsort(-scores, kind = 'mergesort')
+    scores, y_true = scores[order], y_true[order]
+
+    tp = np.cumsum(y_true)
+    fp = np.arange(1, len(y_true) + 1) - tp
+    positives, negatives = int(tp[-1]), len(y_true) - int(tp[-1])
+    weight = beta ** 2
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        fscores = (1 + weight) * tp / ((1 + weight) * tp + weight * (positives - tp) + fp)
+    fscores[np.isnan(fscores)] = 0.0
+    # A cutoff after sample i only exists if the next sample scores lower
+    fscores[:-1][scores[1:] == scores[:-1]] = -1.0
+
+    i = int(np.argmax(fscores))
+    threshold = (scores[i] + scores[i + 1]) / 2. if i + 1 < len(scores) else scores[i] - 1.0
+    return float(threshold), ConfusionCounts(negatives - fp[i], fp[i], positives - tp[i], tp[i])
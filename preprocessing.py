@@ -0,0 +1,153 @@
+"""
+Fitted preprocessing of raw census records into the model feature matrix.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.preprocessing import MinMaxScaler
+
+import census
+
+
+class CensusPreprocessor(BaseEstimator, TransformerMixin):
+    """
+    Log-transform, min-max scale and one-hot encode raw census features.
+
+    The category vocabulary is learned once at fit time, so every batch is
+    transformed into the same fixed-width float32 matrix whatever categories it
+    happens to contain. Categories unseen at fit time encode as all zeros.
+    With 'sparse' set, the mostly-zero indicator block is emitted as a CSR
+    matrix hstacked to the dense numerical columns.
+
+    inputs:
+      - skewed: the columns to log-transform, or 'auto' to pick the numerical
+        columns whose absolute skewness exceeds 'skew_threshold' at fit time
+      - numerical: the columns to scale; they come first in the output
+      - scaler: an unfitted scaler for the numerical columns; MinMaxScaler() if None
+      - categories: a {column: values} vocabulary, or None to learn it from the data
+      - sparse: whether transform returns a scipy CSR matrix instead of a dense array
+      - skew_threshold: the skewness cut-off used when 'skewed' is 'auto'
+    """
+
+    def __init__(self, skewed = census.SKEWED, numerical = census.NUMERICAL, scaler = None,
+                 categories = None, sparse = False, skew_threshold = census.SKEW_THRESHOLD):
+        self.skewed = skewed
+        self.numerical = numerical
+        self.scaler = scaler
+        self.categories = categories
+        self.sparse = sparse
+        self.skew_threshold = skew_threshold
+
+    def _numeric_block(self, X):
+        """
+        Log-transformed numerical columns of 'X' as a float32 array
+
+        The columns are copied into a fresh Fortran-ordered block so that each
+        skewed column is contiguous and transformed in place without touching 'X'.
+        """
+
+        block = np.array(X[self.numerical], dtype = np.float32, order = 'F')
+        for j in self.skewed_indices_:
+            np.log1p(block[:, j], out = block[:, j])
+        return block
+
+    def partial_fit(self, X, y = None):
+        """
+        Update the scaler and the category vocabulary with one batch of raw features
+
+        With 'skewed' set to 'auto', the skewed columns are picked on the first batch.
+        """
+
+        X = pd.DataFrame(X)
+        if not hasattr(self, 'scaler_'):
+            self.scaler_ = clone(self.scaler) if self.scaler is not None else MinMaxScaler()
+            if isinstance(self.skewed, str) and self.skewed == 'auto':
+                self.skewed_ = census.skewed_columns(X, self.numerical, self.skew_threshold)
+            else:
+                self.skewed_ = list(self.skewed)
+            self.skewed_indices_ = [self.numerical.index(c) for c in self.skewed_]
+            self.categorical_ = [c for c in X.columns if c not in self.numerical]
+            if self.categories is not None:
+                self.categories_ = {c: list(self.categories[c]) for c in self.categorical_}
+            else:
+                self.categories_ = {c: [] for c in self.categorical_}
+
+        self.scaler_.partial_fit(self._numeric_block(X))
+        if self.categories is None:
+            for column in self.categorical_:
+                seen = set(self.categories_[column])
+                new = set(X[column].dropna().unique()) - seen
+                self.categories_[column] = sorted(seen | new)
+
+        self._compile()
+        return self
+
+    def fit(self, X, y = None):
+        """
+        Fit the scaler and learn the category vocabulary from raw features
+        """
+
+        for attribute in ('scaler_', 'skewed_', 'categorical_', 'categories_'):
+            self.__dict__.pop(attribute, None)
+        return self.partial_fit(X, y)
+
+    def _compile(self):
+        """
+        Precompute the output layout from the fitted vocabulary
+        """
+
+        self.offsets_ = {}
+        offset = len(self.numerical)
+        for column in self.categorical_:
+            self.offsets_[column] = offset
+            offset += len(self.categories_[column])
+        self.n_features_out_ = offset
+
+    def _codes(self, X):
+        """
+        Output column of every (row, categorical field) indicator, -1 where unknown
+        """
+
+        codes = np.empty((len(X), len(self.categorical_)), dtype = np.int32)
+        for j, column in enumerate(self.categorical_):
+            field = pd.Categorical(X[column], categories = self.categories_[column]).codes
+            codes[:, j] = np.where(field >= 0, self.offsets_[column] + field, -1)
+        return codes
+
+    def transform(self, X):
+        """
+        Encode raw features into 'n_features_out_' float32 columns
+
+        returns a C-ordered array, or a CSR matrix if 'sparse' is set
+        """
+
+        X = pd.DataFrame(X)
+        n_numerical = len(self.numerical)
+        numeric = self.scaler_.transform(self._numeric_block(X)).astype(np.float32)
+        codes = self._codes(X)
+        rows, fields = np.nonzero(codes >= 0)
+        columns = codes[rows, fields]
+
+        if self.sparse:
+            indicators = sp.csr_matrix(
+                (np.ones(len(rows), dtype = np.float32), (rows, columns - n_numerical)),
+                shape = (len(X), self.n_features_out_ - n_numerical))
+            return sp.hstack([sp.csr_matrix(numeric), indicators], format = 'csr')
+
+        # One-hot encoding: set a single 1 per row and field, skipping unknown values
+        output = np.zeros((len(X), self.n_features_out_), dtype = np.float32)
+        output[:, :n_numerical] = numeric
+        output[rows, columns] = 1
+        return output
+
+    def get_feature_names_out(self, input_features = None):
+        """
+        Names of the output columns, matching those of pandas.get_dummies
+        """
+
+        names = list(self.numerical)
+        for column in self.categorical_:
+            names += ["{}_{}".format(column, value) for value in self.categories_[column]]
+        return np.asarray(names, dtype = object)
@@ -0,0 +1,130 @@
+"""
+Feature selection for the finding_donors models.
+
+Candidate feature sets are drawn from an importance ranking (the top k
+features, or the features making up a share of the total importance), a
+clone of the model is refitted on each set in parallel, and the smallest set
+meeting the F-score and latency requirements is chosen.
+"""
+
+from time import perf_counter
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import fbeta_score, accuracy_score
+
+from training import as_array, take_columns
+
+
+def candidate_feature_sets(importances, ks = (), thresholds = ()):
+    """
+    Candidate feature sets from an importance ranking
+
+    inputs:
+      - importances: one importance per column, e.g. feature_importances_ or
+        the mean of a permutation importance
+      - ks: the sizes of the top-k sets
+      - thresholds: the shares of the total importance the cumulative sets reach
+
+    returns a list of (name, column indices) pairs, without duplicate sets,
+    ordered from the smallest set to the largest
+    """
+
+    importances = np.asarray(importances, dtype = np.float64)
+    order = np.argsort(importances)[::-1]
+    cumulative = np.cumsum(np.clip(importances[order], 0, None))
+    cumulative /= cumulative[-1] if cumulative[-1] > 0 else 1.0
+
+    sizes = {}
+    for k in ks:
+        sizes.setdefault(min(int(k), len(order)), "top_{}".format(k))
+    for threshold in thresholds:
+        k = min(int(np.searchsorted(cumulative, threshold)) + 1, len(order))
+        sizes.setdefault(k, "cumulative_{}".format(threshold))
+    return [(sizes[k], order[:k]) for k in sorted(sizes)]
+
+
+def decision_scores(estimator, X):
+    """
+    The decision_function of a fitted estimator, or its positive class probability
+    """
+
+    if hasattr(estimator, 'decision_function'):
+        return estimator.decision_function(X)
+    return estimator.predict_proba(X)[:, 1]
+
+
+def _fit_feature_set(estimator, name, columns, X_train, y_train, X_test, y_test):
+    """
+    Fit a clone of 'estimator' on 'columns' and time and score its held-out predictions
+    """
+
+    X_train, X_test = take_columns(X_train, columns), take_columns(X_test, columns)
+
+    start = perf_counter()
+    estimator = clone(estimator).fit(X_train, y_train)
+    train_time = perf_counter() - start
+
+    start = perf_counter()
+    predictions = estimator.predict(X_test)
+    pred_time = perf_counter() - start
+
+    return {
+        'name': name,
+        'k': len(columns),
+        'columns': columns,
+        'train_time': train_time,
+        'pred_time': pred_time,
+        'pred_latency': pred_time / X_test.shape[0],
+        'accuracy': accuracy_score(y_test, predictions),
+        'fscore': fbeta_score(y_test, predictions, beta = 0.5),
+        'scores': decision_scores(estimator, X_test),
+    }
+
+
+def evaluate_feature_sets(estimator, feature_sets, X_train, y_train, X_test, y_test,
+                          n_jobs = None):
+    """
+    Refit a clone of 'estimator' on every candidate feature set in parallel
+
+    inputs:
+      - estimator: the model to refit, e.g. best_clf
+      - feature_sets: (name, column indices) pairs from candidate_feature_sets
+      - X_train, y_train: the full-width data the clones are fitted on
+      - X_test, y_test: the full-width data they are scored on; a validation
+        split of the training set, as selecting on the testing set would bias
+        the test score of the chosen set
+      - n_jobs: the number of worker processes, -1 for all cores
+
+    returns one report dict per set, with its size 'k', 'train_time',
+    'pred_time' on X_test, per-row 'pred_latency', 'accuracy', 'fscore' and
+    the decision 'scores' of X_test
+    """
+
+    X_train, y_train = as_array(X_train), as_array(y_train)
+    X_test, y_test = as_array(X_test), as_array(y_test)
+    return Parallel(n_jobs = n_jobs, max_nbytes = '1M', mmap_mode = 'r')(
+        delayed(_fit_feature_set)(estimator, name, columns, X_train, y_train, X_test, y_test)
+        for name, columns in feature_sets)
+
+
+def select_feature_set(reports, min_fscore = None, max_latency = None):
+    """
+    The report of the smallest feature set meeting the requirements
+
+    inputs:
+      - reports: the output of evaluate_feature_sets
+      - min_fscore: the lowest acceptable F-score of the reports
+      - max_latency: the highest acceptable prediction time per row, in seconds
+
+    returns None if no set meets them
+    """
+
+    for report in sorted(reports, key = lambda report: report['k']):
+        if min_fscore is not None and report['fscore'] < min_fscore:
+            continue
+        if max_latency is not None and report['pred_latency'] > max_latency:
+            continue
+        return report
+    return None
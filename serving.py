@@ -0,0 +1,350 @@
+"""
+Batched scoring service for the tuned donors model.
+
+Raw census records (JSON objects with the census.csv feature columns) are
+collected into micro-batches of up to 'max_batch' rows or 'max_wait_ms'
+milliseconds, and each batch is encoded and scored with one vectorized call.
+
+Usage:
+    python serving.py best_clf --stdin < records.jsonl > scores.jsonl
+    python serving.py best_clf --port 8080
+"""
+
+import argparse
+import collections
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from artifacts import ArtifactStore, DEFAULT_STORE_DIR
+from compiled import compile_linear
+
+
+class Scorer(object):
+    """
+    Fitted preprocessor and model scoring batches of raw census records
+
+    inputs:
+      - preprocessor: a fitted CensusPreprocessor
+      - model: a fitted classifier
+      - features: the preprocessor columns the model uses, None for all of them
+      - compiled: whether to score a linear model with compiled.LinearScorer,
+        skipping pandas and the one-hot matrix
+      - threshold: the score above which a record is predicted positive, None
+        for the model's default (0 for a decision function, 0.5 for a probability)
+    """
+
+    def __init__(self, preprocessor, model, features = None, compiled = False, threshold = None):
+        self.preprocessor = preprocessor
+        self.model = model
+        if threshold is None:
+            threshold = 0.0 if hasattr(model, 'decision_function') else 0.5
+        self.threshold = threshold
+        self.columns = None
+        if features is not None:
+            names = list(preprocessor.get_feature_names_out())
+            if list(features) != names:
+                self.columns = np.array([names.index(f) for f in features])
+        self.linear = None
+        if compiled:
+            self.linear = compile_linear(preprocessor, model, self.columns, threshold)
+
+    @classmethod
+    def from_store(cls, store, name, version = None, compiled = False):
+        """
+        Load a scorer from a model saved in an ArtifactStore, the latest version by default
+        """
+
+        artifact = store.load(name, version)
+        return cls(artifact.preprocessor, artifact.model, artifact.features, compiled,
+                   artifact.metadata.get('threshold'))
+
+    def score(self, records):
+        """
+        Score a list of records: one {'prediction', 'score'} dict per record
+        """
+
+        if self.linear is not None:
+            scores = self.linear.decision_function_records(records)
+            predictions = self.linear.classes_[(scores > self.linear.threshold).astype(int)]
+            return [{'prediction': int(p), 'score': float(s)} for p, s in zip(predictions, scores)]
+
+        predictions, scores = self.predict(pd.DataFrame.from_records(records))
+        return [{'prediction': int(p), 'score': float(s)} for p, s in zip(predictions, scores)]
+
+    def predict(self, features_raw):
+        """
+        Predicted classes and scores arrays of a DataFrame of raw census features
+        """
+
+        # One vectorized call gives both the scores and the predicted classes
+        scores = self.decision_scores(self.preprocessor.transform(features_raw))
+        predictions = self.model.classes_[(scores > self.threshold).astype(int)]
+        return predictions, scores
+
+    def decision_scores(self, X):
+        """
+        Scores of an encoded feature matrix with all the preprocessor columns
+        """
+
+        if self.columns is not None:
+            X = X[:, self.columns]
+        if hasattr(self.model, 'decision_function'):
+            return self.model.decision_function(X)
+        return self.model.predict_proba(X)[:, 1]
+
+
+class MicroBatcher(object):
+    """
+    Collects records submitted from any thread into micro-batches for one scoring function.
+
+    A background thread waits for the first pending request, then keeps
+    collecting until 'max_batch' rows are pending or 'max_wait_ms' have
+    passed, and scores all of them with one call. Request latencies and
+    throughput are tracked for 'stats'.
+
+    inputs:
+      - score: a function mapping a list of records to a list of results
+      - max_batch: the maximum number of rows per batch
+      - max_wait_ms: the maximum time a request waits for its batch to fill up
+      - history: the number of recent request latencies kept for the percentiles
+    """
+
+    def __init__(self, score, max_batch = 1024, max_wait_ms = 5, history = 100000):
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._pending = queue.Queue()
+        self._latencies = collections.deque(maxlen = history)
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._batches = 0
+        self._started = self._finished = None
+        self._worker = threading.Thread(target = self._run, daemon = True)
+        self._worker.start()
+
+    def submit(self, records):
+        """
+        Queue a list of records; the returned Future resolves to their results
+        """
+
+        future = Future()
+        now = perf_counter()
+        with self._lock:
+            if self._started is None:
+                self._started = now
+        self._pending.put((records, future, now))
+        return future
+
+    def _run(self):
+        while True:
+            requests = [self._pending.get()]
+            n_rows = len(requests[0][0])
+            deadline = perf_counter() + self.max_wait_ms / 1000.0
+            while n_rows < self.max_batch:
+                timeout = deadline - perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._pending.get(timeout = timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                n_rows += len(request[0])
+            self._score(requests, n_rows)
+
+    def _score(self, requests, n_rows):
+        """
+        Score one batch and hand each request its slice of the results
+
+        If the batch fails, its requests are scored again one at a time, so
+        that a request with an invalid record fails alone instead of failing
+        every request batched with it.
+        """
+
+        batch = [record for records, _, _ in requests for record in records]
+        try:
+            results = self.score(batch)
+        except Exception as error:
+            if len(requests) == 1:
+                requests[0][1].set_exception(error)
+                return
+            for request in requests:
+                self._score_alone(request)
+            return
+
+        done = perf_counter()
+        start = 0
+        for records, future, submitted in requests:
+            future.set_result(results[start:start + len(records)])
+            start += len(records)
+            self._latencies.append(done - submitted)
+        self._count(n_rows, done)
+
+    def _score_alone(self, request):
+        """
+        Score the records of one request on their own
+        """
+
+        records, future, submitted = request
+        try:
+            results = self.score(records)
+        except Exception as error:
+            future.set_exception(error)
+            return
+        done = perf_counter()
+        future.set_result(results)
+        self._latencies.append(done - submitted)
+        self._count(len(records), done)
+
+    def _count(self, n_rows, done):
+        with self._lock:
+            self._rows += n_rows
+            self._batches += 1
+            self._finished = done
+
+    def stats(self):
+        """
+        Latency percentiles in milliseconds, mean batch size and throughput in rows per second
+        """
+
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            rows, batches = self._rows, self._batches
+            elapsed = self._finished - self._started if batches else 0.0
+        if not batches:
+            return {'requests': 0, 'rows': 0}
+        return {
+            'requests': len(latencies),
+            'rows': rows,
+            'batches': batches,
+            'mean_batch_rows': rows / float(batches),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'rows_per_second': rows / elapsed if elapsed > 0 else float('inf'),
+        }
+
+
+def serve_stdin(batcher, infile = sys.stdin, outfile = sys.stdout):
+    """
+    Score one JSON record per input line, writing one JSON result per output line in order
+
+    A line that is not valid JSON or fails to score gets an {"error": message}
+    line in its place, so the output stays aligned with the input.
+    """
+
+    futures = queue.Queue()
+
+    def write():
+        while True:
+            future = futures.get()
+            if future is None:
+                break
+            try:
+                result = future.result()[0]
+            except Exception as error:
+                result = {'error': str(error)}
+            outfile.write(json.dumps(result) + '\n')
+        outfile.flush()
+
+    writer = threading.Thread(target = write)
+    writer.start()
+    try:
+        for line in infile:
+            if not line.strip():
+                continue
+            try:
+                future = batcher.submit([json.loads(line)])
+            except Exception as error:
+                future = Future()
+                future.set_exception(error)
+            futures.put(future)
+    finally:
+        futures.put(None)
+        writer.join()
+
+
+def make_handler(batcher):
+    """
+    HTTP handler class: POST /score with a record or a list of records, GET /stats
+    """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                records = payload if isinstance(payload, list) else [payload]
+                results = batcher.submit(records).result()
+            except Exception as error:
+                self._reply(400, {'error': str(error)})
+                return
+            self._reply(200, results if isinstance(payload, list) else results[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Score census records with a saved model.")
+    parser.add_argument('model', help = "name of the model in the artifact store, e.g. best_clf")
+    parser.add_argument('--store', default = DEFAULT_STORE_DIR,
+                        help = "artifact store directory")
+    parser.add_argument('--version', type = int, default = None,
+                        help = "model version, the latest by default")
+    parser.add_argument('--stdin', action = 'store_true',
+                        help = "score JSON lines from stdin instead of serving HTTP")
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--max-batch', type = int, default = 1024,
+                        help = "maximum rows per scoring batch")
+    parser.add_argument('--max-wait-ms', type = float, default = 5,
+                        help = "maximum time a record waits for its batch")
+    parser.add_argument('--compiled', action = 'store_true',
+                        help = "score a linear model with the fused compiled path")
+    args = parser.parse_args(argv)
+
+    scorer = Scorer.from_store(ArtifactStore(args.store), args.model, args.version, args.compiled)
+    batcher = MicroBatcher(scorer.score, args.max_batch, args.max_wait_ms)
+    if args.stdin:
+        serve_stdin(batcher)
+        sys.stderr.write(json.dumps(batcher.stats()) + '\n')
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            sys.stderr.write(json.dumps(batcher.stats()) + '\n')
+
+
+if __name__ == '__main__':
+    main()
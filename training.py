@@ -0,0 +1,425 @@
+"""
+Training and evaluation of the supervised learners compared in finding_donors.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble._forest import BaseForest
+
+import census
+from instrument import Recorder
+from metrics import ConfusionCounts, confusion_by_subset
+
+
+# Rows per minibatch of the out-of-core training
+DEFAULT_BATCH_SIZE = 4096
+MIN_TREES = 10
+
+
+class StratifiedSampler(object):
+    """
+    Stratified, shuffled training subsets shared by all learners.
+
+    Each class is shuffled once with 'random_state', and a subset of a given
+    size takes the same leading fraction of every class, so subsets keep the
+    class balance and smaller ones are (almost always) contained in larger
+    ones. Index arrays are computed once per size and sorted for sequential
+    memory access.
+
+    inputs:
+      - y: the training labels
+      - random_state: the seed of the shuffle
+    """
+
+    def __init__(self, y, random_state = 0):
+        y = np.asarray(y)
+        self.random_state = random_state
+        self.n_samples = len(y)
+        rng = np.random.RandomState(random_state)
+        self.classes_ = np.unique(y)
+        self.permutations_ = [rng.permutation(np.flatnonzero(y == c)) for c in self.classes_]
+        self._indices = {}
+
+    def indices(self, sample_size):
+        """
+        Sorted row indices of the stratified subset of 'sample_size' rows
+        """
+
+        if sample_size not in self._indices:
+            sample_size = min(sample_size, self.n_samples)
+            counts = np.array([len(p) for p in self.permutations_])
+            quotas = sample_size * counts / float(self.n_samples)
+            taken = np.floor(quotas).astype(int)
+
+            # Hand the rows lost to rounding to the largest remainders
+            remainder = sample_size - taken.sum()
+            taken[np.argsort(taken - quotas)[:remainder]] += 1
+
+            sample = np.concatenate([p[:k] for p, k in zip(self.permutations_, taken)])
+            sample.sort()
+            self._indices[sample_size] = sample
+        return self._indices[sample_size]
+
+
+def take_rows(X, indices):
+    """
+    Rows of an array, CSR matrix, DataFrame or Series at the given positions
+    """
+
+    if sp.issparse(X):
+        return X[indices]
+    if hasattr(X, 'iloc'):
+        return X.iloc[indices]
+    return np.take(X, indices, axis = 0)
+
+
+def take_columns(X, indices):
+    """
+    Columns of an array, CSR matrix or DataFrame at the given positions
+    """
+
+    if sp.issparse(X):
+        return X[:, indices]
+    if hasattr(X, 'iloc'):
+        return X.iloc[:, indices]
+    return np.take(X, indices, axis = 1)
+
+
+def _evaluate(learner, X_eval, y_eval, X_test, y_test, results, recorder = None, fields = None):
+    """
+    Time the predictions of a fitted learner and add its scores to 'results'.
+    'X_eval' and 'y_eval' are the 300 training samples scored for the training subset.
+    The two predictions are recorded as separate 'predict_test' and 'predict_train' phases.
+    """
+
+    recorder = Recorder() if recorder is None else recorder
+    fields = fields or {}
+
+    # Get the predictions on the test set(X_test),
+    #       then get predictions on the 300 training samples(X_eval) using .predict()
+    with recorder.phase('predict_test', rows = len(y_test), **fields) as test:
+        predictions_test = learner.predict(X_test)
+    with recorder.phase('predict_train', rows = len(y_eval), **fields) as train:
+        predictions_train = learner.predict(X_eval)
+
+    # Calculate the total prediction time, and its split between the two sets
+    results['pred_test_time'] = test['wall_ns'] / 1e9
+    results['pred_train_time'] = train['wall_ns'] / 1e9
+    results['pred_time'] = results['pred_test_time'] + results['pred_train_time']
+    results['pred_cpu_time'] = (test['cpu_ns'] + train['cpu_ns']) / 1e9
+    results['pred_latency'] = test['latency_ns'] / 1e9
+    if 'tracemalloc_peak_bytes' in test:
+        results['pred_peak_bytes'] = max(test['tracemalloc_peak_bytes'],
+                                         train['tracemalloc_peak_bytes'])
+
+    # Score both sets from their confusion counts, computed in one bincount pass
+    subsets = np.repeat([0, 1], [len(predictions_test), len(predictions_train)])
+    test_counts, train_counts = confusion_by_subset(
+        np.concatenate([as_array(y_test), as_array(y_eval)]),
+        np.concatenate([predictions_test, predictions_train]), subsets, 2)
+
+    # Compute accuracy on the 300 training samples which is y_eval
+    results['acc_train'] = train_counts.accuracy()
+
+    # Compute accuracy on test set
+    results['acc_test'] = test_counts.accuracy()
+
+    # Compute F-score on the 300 training samples
+    results['f_train'] = train_counts.fbeta(beta = 0.5)
+
+    # Compute F-score on the test set which is y_test
+    results['f_test'] = test_counts.fbeta(beta = 0.5)
+
+    # Keep the counts, so that the scores of several runs can be aggregated exactly
+    results['counts_test'] = test_counts.counts()
+    results['counts_train'] = train_counts.counts()
+
+    return results
+
+
+def _subsets(sampler, sample_size, X_train, y_train):
+    """
+    The training subset of 'sample_size' rows and the 300 rows scored for training
+    """
+
+    if sampler is None:
+        return (X_train[:sample_size], y_train[:sample_size], X_train[:300], y_train[:300])
+    sample, scored = sampler.indices(sample_size), sampler.indices(300)
+    return (take_rows(X_train, sample), take_rows(y_train, sample),
+            take_rows(X_train, scored), take_rows(y_train, scored))
+
+
+def train_predict(learner, sample_size, X_train, y_train, X_test, y_test, sampler = None,
+                  recorder = None):
+    '''
+    inputs:
+       - learner: the learning algorithm to be trained and predicted on; it is
+         cloned, so the instance passed in is left untouched
+       - sample_size: the size of samples (number) to be drawn from training set
+       - X_train: features training set
+       - y_train: income training set
+       - X_test: features testing set
+       - y_test: income testing set
+       - sampler: a StratifiedSampler drawing the training samples; without
+         one, the first 'sample_size' rows are used
+       - recorder: an instrument.Recorder receiving the 'subset', 'fit',
+         'predict_test' and 'predict_train' phase records
+    '''
+
+    results = {}
+    recorder = Recorder() if recorder is None else recorder
+    fields = {'learner': learner.__class__.__name__, 'sample_size': sample_size}
+
+    with recorder.phase('subset', rows = sample_size, **fields) as subset:
+        X_sample, y_sample, X_eval, y_eval = _subsets(sampler, sample_size, X_train, y_train)
+
+    # Fit a fresh copy of the learner to the 'sample_size' training samples using .fit()
+    with recorder.phase('fit', rows = len(y_sample), **fields) as fit:
+        learner = clone(learner).fit(X_sample, y_sample)
+
+    # Calculate the training time, and the CPU time of all threads of the fit
+    results['subset_time'] = subset['wall_ns'] / 1e9
+    results['train_time'] = fit['wall_ns'] / 1e9
+    results['train_cpu_time'] = fit['cpu_ns'] / 1e9
+    if 'tracemalloc_peak_bytes' in fit:
+        results['subset_peak_bytes'] = subset['tracemalloc_peak_bytes']
+        results['train_peak_bytes'] = fit['tracemalloc_peak_bytes']
+
+    _evaluate(learner, X_eval, y_eval, X_test, y_test, results, recorder, fields)
+
+    # Success
+    print("{} trained on {} samples.".format(learner.__class__.__name__, sample_size))
+
+    # Return the results
+    return results
+
+
+def incremental_learning_curve(learner, sample_sizes, X_train, y_train, X_test, y_test,
+                               n_epochs = 5, sampler = None, recorder = None):
+    """
+    Grow one model through increasing sample sizes, scoring it at each size.
+
+    Learners with warm_start continue from the model of the previous size:
+    forests (RandomForestClassifier) add trees fitted on the current sample,
+    so that the final forest has 'n_estimators' trees grown in proportion to
+    the sample sizes, and linear models (SGDClassifier) refit the current
+    sample from the previous coefficients until the stopping criterion of
+    their fit, so every point is comparable to a full fit at that size.
+    Either way the whole curve costs little more than one full fit. A forest
+    starts from at least MIN_TREES trees, so its early points measure a
+    smaller forest than train_predict fits at those sizes, trained on the
+    samples seen so far. Learners with partial_fit only make 'n_epochs'
+    passes over all the rows seen so far, and other learners, boosting
+    included, are refitted from scratch at every size.
+
+    inputs:
+      - learner: the learner to grow; it is cloned
+      - sample_sizes: the increasing training sample sizes
+      - X_train, y_train, X_test, y_test: as for train_predict
+      - n_epochs: the number of partial_fit passes over the sample at each size
+      - sampler: as for train_predict
+      - recorder: as for train_predict
+
+    returns the {size index: results} dict of train_predict, where
+    'train_time' is the cumulative training time up to that size
+    """
+
+    learner = clone(learner)
+    classes = np.unique(y_train)
+    forest = isinstance(learner, BaseForest)
+    total_trees = learner.get_params()['n_estimators'] if forest else None
+    # Boosting learners also have warm_start, but it only adds iterations to
+    # the trees fitted on the smaller samples, so they are refitted instead
+    if 'warm_start' in learner.get_params() and (forest or hasattr(learner, 'partial_fit')):
+        mode = 'warm_start'
+        learner.set_params(warm_start = True)
+    elif hasattr(learner, 'partial_fit'):
+        mode = 'partial_fit'
+    else:
+        mode = 'refit'
+
+    recorder = Recorder() if recorder is None else recorder
+    curve = {}
+    train_time = 0
+    for i, sample_size in enumerate(sample_sizes):
+        X_sample, y_sample, X_eval, y_eval = _subsets(sampler, sample_size, X_train, y_train)
+
+        fields = {'learner': learner.__class__.__name__, 'sample_size': sample_size, 'mode': mode}
+        with recorder.phase('fit', **fields) as fit:
+            if mode == 'partial_fit':
+                for epoch in range(n_epochs):
+                    learner.partial_fit(X_sample, y_sample, classes = classes)
+            else:
+                if forest:
+                    n_trees = int(round(total_trees * sample_size / sample_sizes[-1]))
+                    n_trees = min(total_trees, max(MIN_TREES, n_trees))
+                    learner.set_params(n_estimators = max(n_trees, len(getattr(learner, 'estimators_', []))))
+                learner.fit(X_sample, y_sample)
+        train_time += fit['wall_ns'] / 1e9
+
+        curve[i] = _evaluate(learner, X_eval, y_eval, X_test, y_test,
+                             {'train_time': train_time}, recorder, fields)
+        print("{} grown to {} samples.".format(learner.__class__.__name__, sample_size))
+
+    return curve
+
+
+def iter_csv_rows(path, chunksize = census.DEFAULT_CHUNKSIZE, holdout_every = 0,
+                  holdout = False):
+    """
+    Yield the (features_raw, income) chunks of a census CSV, optionally one side of a split
+
+    With 'holdout_every' set, every holdout_every-th row of the file is held
+    out: the chunks keep only those rows if 'holdout' is set, and only the
+    others otherwise. The split depends on the row positions alone, so it is
+    the same on every pass over the file.
+    """
+
+    start = 0
+    for chunk in census.read_census(path, chunksize):
+        if holdout_every:
+            held = (np.arange(start, start + len(chunk)) % holdout_every) == 0
+            start += len(chunk)
+            chunk = chunk[held if holdout else ~held]
+        yield census.split_features(chunk)
+
+
+def iter_csv_minibatches(path, preprocessor, batch_size = DEFAULT_BATCH_SIZE,
+                         chunksize = census.DEFAULT_CHUNKSIZE, random_state = None,
+                         holdout_every = 0, holdout = False):
+    """
+    Yield shuffled (X, y) minibatches encoded by a fitted preprocessor from a census CSV
+
+    The file is read one chunk at a time, so only one chunk is ever in memory;
+    rows are shuffled within each chunk. 'holdout_every' and 'holdout' select
+    one side of a split of the rows, as for iter_csv_rows.
+    """
+
+    rng = np.random.RandomState(random_state)
+    for features_raw, income in iter_csv_rows(path, chunksize, holdout_every, holdout):
+        X, y = preprocessor.transform(features_raw), income.to_numpy()
+        permutation = rng.permutation(len(y))
+        for start in range(0, len(y), batch_size):
+            batch = permutation[start:start + batch_size]
+            yield take_rows(X, batch), y[batch]
+
+
+def train_out_of_core(estimator, minibatches, classes = (0, 1), n_epochs = 5, random_state = 0):
+    """
+    Fit a clone of an incremental learner with partial_fit over streamed minibatches
+
+    inputs:
+      - estimator: a learner with partial_fit, e.g. best_clf; its tuned
+        parameters (penalty, alpha, ...) are kept
+      - minibatches: a function of (epoch, random_state) returning an iterable
+        of (X, y) minibatches, e.g. a wrapper of iter_csv_minibatches
+      - classes: every class of the labels, as partial_fit needs them up front
+      - n_epochs: the number of passes over the data, reshuffled every time
+      - random_state: the base seed of the per-epoch shuffles
+
+    returns the fitted estimator
+    """
+
+    estimator = clone(estimator)
+    classes = np.asarray(classes)
+    for epoch in range(n_epochs):
+        for X, y in minibatches(epoch, random_state + epoch):
+            estimator.partial_fit(X, y, classes = classes)
+    return estimator
+
+
+def evaluate_minibatches(model, minibatches):
+    """
+    Confusion counts of a fitted model over streamed (X, y) minibatches
+
+    Only the counts are kept, so the exact scores of data larger than memory
+    are computed one minibatch at a time; the counts of parallel workers add up.
+    """
+
+    counts = ConfusionCounts()
+    for X, y in minibatches:
+        counts.update(y, model.predict(X))
+    return counts
+
+
+def as_array(X):
+    """
+    Plain C-ordered array (or CSR matrix) view of a feature or label set
+    """
+
+    if sp.issparse(X):
+        return X.tocsr()
+    return np.ascontiguousarray(X)
+
+
+def _train_predict_job(learner, sample_size, X_train, y_train, X_test, y_test, sampler,
+                       trace_memory):
+    """
+    train_predict in a worker, returning its results and its phase records
+    """
+
+    recorder = Recorder(trace_memory = trace_memory)
+    results = train_predict(learner, sample_size, X_train, y_train, X_test, y_test, sampler,
+                            recorder)
+    return results, recorder.records
+
+
+def train_predict_many(learners, sample_sizes, X_train, y_train, X_test, y_test,
+                       n_jobs = None, random_state = 0, recorder = None, inputs = None):
+    """
+    Run train_predict for every (learner, sample size) pair on a process pool.
+
+    Each job fits its own clone of the learner on a stratified, shuffled
+    sample. The data sets are converted once to plain arrays, which joblib
+    memory-maps and shares with the workers instead of pickling a copy per
+    job, and the sample indices are computed once and shared by all learners.
+    Timings are taken inside the workers, which send their phase records
+    back to be emitted by 'recorder' in the main process.
+
+    inputs:
+      - learners: a list of learners, or a {name: learner} dict
+      - sample_sizes: the training sample sizes, in the order of the results
+      - X_train, y_train, X_test, y_test: as for train_predict
+      - n_jobs: the number of worker processes, -1 for all cores
+      - random_state: the seed of the StratifiedSampler drawing the samples
+      - recorder: an instrument.Recorder receiving the phase records of every
+        job; its 'trace_memory' setting applies to the workers
+      - inputs: a {learner name: (X_train, X_test)} dict of the learners
+        fitted on other features of the same rows, such as the bin codes of
+        boosting.QuantileBinner
+
+    returns the {learner name: {size index: train_predict results}} dict
+    consumed by vs.evaluate
+    """
+
+    if not isinstance(learners, dict):
+        learners = {learner.__class__.__name__: learner for learner in learners}
+    y_train, y_test = as_array(y_train), as_array(y_test)
+    shared = (as_array(X_train), as_array(X_test))
+    features = {name: shared for name in learners}
+    for name, (X_train, X_test) in (inputs or {}).items():
+        features[name] = (as_array(X_train), as_array(X_test))
+
+    sampler = StratifiedSampler(y_train, random_state)
+    for size in list(sample_sizes) + [300]:
+        sampler.indices(size)
+
+    # Submit the largest fits first so that they do not end up as stragglers
+    jobs = [(name, i, size) for name in learners for i, size in enumerate(sample_sizes)]
+    jobs.sort(key = lambda job: -job[2])
+    trace_memory = recorder is not None and recorder.trace_memory
+
+    outputs = Parallel(n_jobs = n_jobs, max_nbytes = '1M', mmap_mode = 'r')(
+        delayed(_train_predict_job)(learners[name], size, features[name][0], y_train,
+                                    features[name][1], y_test, sampler, trace_memory)
+        for name, i, size in jobs)
+
+    results = {name: {} for name in learners}
+    for (name, i, size), (output, records) in sorted(zip(jobs, outputs),
+                                                     key = lambda pair: pair[0][1]):
+        results[name][i] = output
+        if recorder is not None:
+            recorder.extend(records)
+    return results
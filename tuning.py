@@ -0,0 +1,396 @@
+"""
+Hyperparameter search for the finding_donors learners.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+from time import time
+
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+from cache import array_digest
+from training import StratifiedSampler, as_array, take_rows
+
+
+# Rows copied at a time into the fold layout
+CHUNK_ROWS = 65536
+
+
+class FoldEngine(object):
+    """
+    Fold-ordered copy of a training set whose fold slices are zero-copy views
+
+    The rows are copied once, as C-ordered float32, in the order of the test
+    folds followed by all but the last of them again:
+
+        test_0 test_1 ... test_K-1 test_0 ... test_K-2
+
+    so the test set of fold k is block k and its training set is the K-1
+    blocks that follow, both contiguous. The copy is a memory-mapped file,
+    which joblib hands to the worker processes by reference: every candidate
+    and fold reads the same pages instead of slicing its own copy, so the
+    memory of the search is (2K - 1) / K times the data whatever 'n_jobs'.
+    A CSR matrix is copied the same way into memory-mapped data, indices and
+    indptr files; the views of a fold share the first two, and only rebase
+    its slice of indptr (one integer per row).
+
+    Use it as a context manager, or call 'close' to remove the files.
+
+    inputs:
+      - X, y: the features and labels
+      - folds: the (train, test) index pairs of a K-fold partition of 'rows'
+      - rows: the rows of X and y the folds index, None for all of them
+      - directory: where the temporary files are created, the system default if None
+    """
+
+    def __init__(self, X, y, folds, rows = None, directory = None):
+        tests = [np.asarray(test, dtype = np.intp) for _, test in folds]
+        n_samples = X.shape[0] if rows is None else len(rows)
+        if sum(len(test) for test in tests) != n_samples:
+            raise ValueError("The test sets of the folds must partition the samples.")
+        self.n_folds = len(tests)
+        self.n_samples = n_samples
+        self.n_features = X.shape[1]
+
+        # Row of the layout -> sample index, then -> row of X and y
+        self.order = np.concatenate(tests + tests[:-1])
+        self.starts = np.cumsum([0] + [len(test) for test in tests])
+        source = self.order if rows is None else np.asarray(rows)[self.order]
+
+        self.y = np.asarray(y)[source]
+        self.directory = tempfile.mkdtemp(prefix = 'folds-', dir = directory)
+        if sp.issparse(X):
+            self.X = None
+            self.X_data, self.X_indices, self.X_indptr = self._copy_csr(X.tocsr(), source)
+            return
+        self.X_data = self.X_indices = self.X_indptr = None
+        layout = self._open(np.float32, (len(source), X.shape[1]), 'X')
+        for start in range(0, len(source), CHUNK_ROWS):
+            layout[start:start + CHUNK_ROWS] = take_rows(X, source[start:start + CHUNK_ROWS])
+        self.X = self._reopen(layout, 'X')
+
+    def _open(self, dtype, shape, name):
+        return np.lib.format.open_memmap(os.path.join(self.directory, name + '.npy'),
+                                         mode = 'w+', dtype = dtype, shape = shape)
+
+    def _reopen(self, layout, name):
+        layout.flush()
+        del layout
+        return np.load(os.path.join(self.directory, name + '.npy'), mmap_mode = 'r')
+
+    def _copy_csr(self, X, source):
+        """
+        Memory-mapped data, indices and indptr of the rows 'source' of a CSR matrix
+        """
+
+        counts = np.diff(X.indptr)[source]
+        nnz = int(counts.sum())
+        index_dtype = np.int32 if max(nnz, X.shape[1]) <= np.iinfo(np.int32).max else np.int64
+        indptr = self._open(index_dtype, (len(source) + 1,), 'indptr')
+        indptr[0] = 0
+        np.cumsum(counts, out = indptr[1:])
+        data = self._open(np.float32, (nnz,), 'data')
+        indices = self._open(index_dtype, (nnz,), 'indices')
+        for start in range(0, len(source), CHUNK_ROWS):
+            chunk = X[source[start:start + CHUNK_ROWS]]
+            a, b = indptr[start], indptr[min(start + CHUNK_ROWS, len(source))]
+            data[a:b] = chunk.data
+            indices[a:b] = chunk.indices
+        return (self._reopen(data, 'data'), self._reopen(indices, 'indices'),
+                self._reopen(indptr, 'indptr'))
+
+    def _rows(self, rows):
+        """
+        View of a slice of rows of the layout
+        """
+
+        if self.X_indptr is None:
+            return self.X[rows]
+        a, b = self.X_indptr[rows.start], self.X_indptr[rows.stop]
+        return sp.csr_matrix((self.X_data[a:b], self.X_indices[a:b],
+                              self.X_indptr[rows.start:rows.stop + 1] - a),
+                             shape = (rows.stop - rows.start, self.n_features), copy = False)
+
+    def _slices(self, k):
+        start = self.starts[k + 1]
+        test = slice(self.starts[k], self.starts[k + 1])
+        train = slice(start, start + self.n_samples - (test.stop - test.start))
+        return train, test
+
+    def fold(self, k):
+        """
+        (X_train, y_train, X_test, y_test) views of fold k
+        """
+
+        train, test = self._slices(k)
+        return self._rows(train), self.y[train], self._rows(test), self.y[test]
+
+    def indices(self, k):
+        """
+        Sample indices of the training and test rows of fold k, in the order of the views
+        """
+
+        train, test = self._slices(k)
+        return self.order[train], self.order[test]
+
+    def close(self):
+        """
+        Release the copy and remove its files
+        """
+
+        self.X = self.y = self.X_data = self.X_indices = self.X_indptr = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors = True)
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _fit_and_score(estimator, params, X_train, y_train, X_test, y_test, scorer,
+                   deadline = None, cache = None, key = None):
+    """
+    Fit a clone of 'estimator' with 'params' on one fold and score it on the held-out part.
+
+    A score found in the FitCache 'cache' under 'key' is returned without
+    fitting; new scores are added to it. Returns NaN without fitting once the
+    'deadline' has passed.
+    """
+
+    if cache is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['score']
+
+    if deadline is not None and time() > deadline:
+        return np.nan
+    estimator = clone(estimator).set_params(**params)
+    start = time()
+    estimator.fit(X_train, y_train)
+    fit_time = time() - start
+    score = scorer(estimator, X_test, y_test)
+
+    if cache is not None:
+        cache.put(key, {'score': float(score), 'fit_time': fit_time})
+    return score
+
+
+class _BaseSearch(object):
+    """
+    Shared cross-validation and bookkeeping of the searches below
+    """
+
+    def _cross_validate(self, parallel, candidates, indices, engine, deadline = None,
+                        data_digest = None):
+        """
+        Fold scores of the candidates at 'indices' on the folds of a FoldEngine, one
+        row per candidate
+        """
+
+        keys = [[None] * engine.n_folds for _ in indices]
+        if self.cache is not None:
+            for i, c in enumerate(indices):
+                estimator = clone(self.estimator).set_params(**candidates[c])
+                for k in range(engine.n_folds):
+                    keys[i][k] = self.cache.key(data_digest, estimator, self.scoring,
+                                                *engine.indices(k))
+
+        scores = parallel(delayed(_fit_and_score)(self.estimator, candidates[c], *engine.fold(k),
+                              scorer = self.scoring, deadline = deadline, cache = self.cache,
+                              key = keys[i][k])
+                          for i, c in enumerate(indices) for k in range(engine.n_folds))
+        return np.asarray(scores, dtype = np.float64).reshape(len(indices), engine.n_folds)
+
+    def _record(self, candidates, indices, scores, **columns):
+        """
+        Append the scores of one round to 'cv_results_'
+        """
+
+        for c, row in zip(indices, scores):
+            self.cv_results_['params'].append(candidates[c])
+            self.cv_results_['mean_test_score'].append(row.mean())
+            self.cv_results_['std_test_score'].append(row.std())
+            for name, value in columns.items():
+                self.cv_results_.setdefault(name, []).append(value)
+
+    def _finish(self, candidates, best_index, best_score, X, y, start):
+        """
+        Store the best candidate, refit it on the whole data and evict old cache entries
+        """
+
+        self.best_index_ = best_index
+        self.best_params_ = candidates[best_index]
+        self.best_score_ = best_score
+        self.n_candidates_ = len(candidates)
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        if self.cache is not None:
+            self.cache.evict()
+        self.search_time_ = time() - start
+        return self
+
+
+class MemoizedGridSearch(_BaseSearch):
+    """
+    Exhaustive grid search whose fold scores persist in a FitCache across runs.
+
+    Rerunning the search on the same data only fits the (candidate, fold)
+    pairs missing from the cache, so growing the grid by one value costs only
+    the new cells. The best candidate is chosen from the cached and the new
+    scores alike, as GridSearchCV would.
+
+    inputs:
+      - estimator, param_grid, scoring: as for GridSearchCV
+      - cv: the number of stratified folds, fixed by 'random_state' across runs
+      - n_jobs: the number of worker processes, -1 for all cores
+      - cache: the FitCache holding the fold scores, None to disable memoization
+      - random_state: the seed of the folds
+      - refit: whether to refit the best candidate on the whole data set
+    """
+
+    def __init__(self, estimator, param_grid, scoring, cv = 5, n_jobs = None, cache = None,
+                 random_state = 0, refit = True):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.random_state = random_state
+        self.refit = refit
+
+    def fit(self, X, y):
+        """
+        Run the search on the training data and return self
+        """
+
+        start = time()
+        X, y = as_array(X), as_array(y)
+        candidates = list(ParameterGrid(self.param_grid))
+        folds = list(StratifiedKFold(self.cv, shuffle = True,
+                                     random_state = self.random_state).split(X, y))
+        data_digest = array_digest(X, y) if self.cache is not None else None
+        self.cv_results_ = {'params': [], 'mean_test_score': [], 'std_test_score': []}
+
+        indices = list(range(len(candidates)))
+        with Parallel(n_jobs = self.n_jobs, max_nbytes = '1M', mmap_mode = 'r') as parallel, \
+                FoldEngine(X, y, folds) as engine:
+            scores = self._cross_validate(parallel, candidates, indices, engine,
+                                          data_digest = data_digest)
+        self._record(candidates, indices, scores)
+
+        means = scores.mean(axis = 1)
+        best = int(np.argmax(means))
+        return self._finish(candidates, best, means[best], X, y, start)
+
+
+class SuccessiveHalvingSearch(_BaseSearch):
+    """
+    Successive-halving replacement for GridSearchCV.
+
+    All candidates of the grid are first cross-validated on a small stratified
+    sample of the data. Only the best 1/'factor' of them go on to the next
+    round, which uses 'factor' times more data, until the last round runs on
+    the full data set. The folds of each round run in parallel, and the search
+    stops early once 'time_budget' seconds have passed, keeping the best
+    candidate of the last completed round, or the best completed candidate
+    of the first round if even that one was cut short.
+
+    inputs:
+      - estimator: the learner to tune
+      - param_grid: the {parameter: values} grid, as for GridSearchCV
+      - scoring: a scorer such as make_scorer(fbeta_score, beta=0.5)
+      - cv: the number of stratified folds
+      - factor: the fraction of candidates dropped and the data growth per round
+      - min_resources: the minimum number of samples of the first round
+      - n_jobs: the number of worker processes, -1 for all cores
+      - time_budget: the wall-clock budget in seconds, None for no limit
+      - random_state: the seed of the samples and of the folds
+      - refit: whether to refit the best candidate on the whole data set
+      - cache: a FitCache memoizing the fold scores, None to disable memoization
+    """
+
+    def __init__(self, estimator, param_grid, scoring, cv = 5, factor = 3, min_resources = None,
+                 n_jobs = None, time_budget = None, random_state = 0, refit = True, cache = None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.factor = factor
+        self.min_resources = min_resources
+        self.n_jobs = n_jobs
+        self.time_budget = time_budget
+        self.random_state = random_state
+        self.refit = refit
+        self.cache = cache
+
+    def _schedule(self, n_candidates, n_samples, n_classes):
+        """
+        Number of samples used by each round, the last one using all of them
+        """
+
+        n_rounds = max(1, int(math.ceil(math.log(n_candidates) / math.log(self.factor))))
+        min_resources = self.min_resources or 2 * self.cv * n_classes
+        return [max(min_resources, n_samples // self.factor ** (n_rounds - 1 - i))
+                for i in range(n_rounds)]
+
+    def fit(self, X, y):
+        """
+        Run the search on the training data and return self
+        """
+
+        start = time()
+        deadline = start + self.time_budget if self.time_budget is not None else None
+        X, y = as_array(X), as_array(y)
+        sampler = StratifiedSampler(y, self.random_state)
+        candidates = list(ParameterGrid(self.param_grid))
+        data_digest = array_digest(X, y) if self.cache is not None else None
+        self.cv_results_ = {'params': [], 'iter': [], 'n_resources': [],
+                            'mean_test_score': [], 'std_test_score': []}
+
+        survivors = list(range(len(candidates)))
+        best = None
+        with Parallel(n_jobs = self.n_jobs, max_nbytes = '1M', mmap_mode = 'r') as parallel:
+            for iteration, n_resources in enumerate(self._schedule(len(candidates), len(y),
+                                                                   len(sampler.classes_))):
+                sample = sampler.indices(n_resources)
+                y_round = take_rows(y, sample)
+                folds = list(StratifiedKFold(self.cv, shuffle = True,
+                    random_state = self.random_state).split(np.zeros(len(sample)), y_round))
+
+                round_digest = data_digest and data_digest + array_digest(sample)
+                with FoldEngine(X, y, folds, rows = sample) as engine:
+                    scores = self._cross_validate(parallel, candidates, survivors, engine,
+                                                  deadline, round_digest)
+                self._record(candidates, survivors, scores, iter = iteration,
+                             n_resources = n_resources)
+
+                # Candidates cut short by the time budget have NaN scores; a round
+                # cut short keeps the winner of the previous complete round, and
+                # only the first round falls back to its best completed candidate
+                means = scores.mean(axis = 1)
+                complete = ~np.isnan(means)
+                if not complete.any():
+                    break
+                ranking = [survivors[i] for i in np.argsort(-means, kind = 'stable') if complete[i]]
+                if not complete.all():
+                    if best is None:
+                        best = ranking[0], means[survivors.index(ranking[0])]
+                    break
+                best = ranking[0], means[survivors.index(ranking[0])]
+                if deadline is not None and time() > deadline:
+                    break
+                survivors = ranking[:max(1, int(math.ceil(len(survivors) / float(self.factor))))]
+
+        if best is None:
+            raise RuntimeError("The time budget ran out before any candidate was evaluated.")
+        return self._finish(candidates, best[0], best[1], X, y, start)
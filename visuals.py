@@ -1,28 +1,75 @@
 ###########################################
-# Suppress matplotlib user warnings
-# Necessary for newer version of matplotlib
-import warnings
-warnings.filterwarnings("ignore", category = UserWarning, module = "matplotlib")
-#
-# Display inline matplotlib plots with IPython
-from IPython import get_ipython
-get_ipython().run_line_magic('matplotlib', 'inline')
+# matplotlib is imported on the first plot, so that importing this module
+# costs nothing to the jobs that never plot. Inside IPython the plots are
+# displayed inline; elsewhere without a display the headless Agg backend is
+# used and the plots can be saved with the 'path' argument.
 ###########################################
 
-import matplotlib.pyplot as pl
-import matplotlib.patches as mpatches
+import os
+import sys
+import warnings
+
 import numpy as np
-import pandas as pd
-from time import time
-from sklearn.metrics import f1_score, accuracy_score
 
+import instrument
+
+
+# Backend of the runs without IPython nor a display, e.g. batch jobs
+HEADLESS_BACKEND = 'Agg'
+
+# Bar colors of the learners
+COLORS = ['#A00000','#00A0A0','#00A000','#A0A000','#0000A0']
+
+_pyplot = None
+
+
+def pyplot():
+    """
+    matplotlib.pyplot, imported and set up on first use
+    """
+
+    global _pyplot
+    if _pyplot is None:
+        # Suppress matplotlib user warnings
+        # Necessary for newer version of matplotlib
+        warnings.filterwarnings("ignore", category = UserWarning, module = "matplotlib")
+
+        import matplotlib
+        # Only a running IPython has imported it, so that this costs no import
+        shell = sys.modules['IPython'].get_ipython() if 'IPython' in sys.modules else None
+        if shell is not None:
+            # Display inline matplotlib plots with IPython
+            shell.run_line_magic('matplotlib', 'inline')
+        elif ('MPLBACKEND' not in os.environ and not os.environ.get('DISPLAY')
+                and sys.platform.startswith('linux')):
+            matplotlib.use(HEADLESS_BACKEND)
+
+        import matplotlib.pyplot
+        _pyplot = matplotlib.pyplot
+    return _pyplot
 
-def distribution(data, transformed = False):
+
+def _show(fig, path):
     """
-    Visualization code for displaying skewed distributions of features
+    Save the figure to 'path' and close it, or show it if 'path' is None
+    """
+
+    pl = pyplot()
+    if path is None:
+        pl.show()
+    else:
+        fig.savefig(path, bbox_inches = 'tight')
+        pl.close(fig)
+
+
+def distribution(data, transformed = False, path = None):
+    """
+    Visualization code for displaying skewed distributions of features.
+    The figure is saved to 'path' instead of shown if given.
     """
     
     # Create figure
+    pl = pyplot()
     fig = pl.figure(figsize = (11,5));
 
     # Skewed feature plotting
@@ -45,10 +92,10 @@ def distribution(data, transformed = False):
             fontsize = 16, y = 1.03)
 
     fig.tight_layout()
-    fig.show()
+    _show(fig, path)
 
 
-def evaluate(results, accuracy, f1):
+def evaluate(results, accuracy, f1, records = None, path = None):
     """
     Visualization code to display results of various learners.
     
@@ -57,14 +104,19 @@ def evaluate(results, accuracy, f1):
       - stats: a list of dictionaries of the statistic results from 'train_predict()'
       - accuracy: The score for the naive predictor
       - f1: The score for the naive predictor
+      - records: the phase records of an instrument.Recorder passed to
+        'train_predict()', plotted with 'phases()' below the results
+      - path: the file the figure is saved to instead of shown
     """
   
     # Create figure
+    pl = pyplot()
+    from matplotlib.patches import Patch
     fig, ax = pl.subplots(2, 3, figsize = (11,7))
 
     # Constants
-    bar_width = 0.3
-    colors = ['#A00000','#00A0A0','#00A000']
+    bar_width = 0.9 / max(3, len(results))
+    colors = COLORS
     
     # Super loop to plot four panels of data
     for k, learner in enumerate(results.keys()):
@@ -72,8 +124,8 @@ def evaluate(results, accuracy, f1):
             for i in np.arange(3):
                 
                 # Creative plot code
-                ax[j//3, j%3].bar(i+k*bar_width, results[learner][i][metric], width = bar_width, color = colors[k])
-                ax[j//3, j%3].set_xticks([0.45, 1.45, 2.45])
+                ax[j//3, j%3].bar(i+k*bar_width, results[learner][i][metric], width = bar_width, color = colors[k % len(colors)])
+                ax[j//3, j%3].set_xticks(np.arange(3) + bar_width*(len(results) - 1)/2.)
                 ax[j//3, j%3].set_xticklabels(["1%", "10%", "100%"])
                 ax[j//3, j%3].set_xlabel("Training Set Size")
                 ax[j//3, j%3].set_xlim((-0.1, 3.0))
@@ -109,24 +161,95 @@ def evaluate(results, accuracy, f1):
     # Create patches for the legend
     patches = []
     for i, learner in enumerate(results.keys()):
-        patches.append(mpatches.Patch(color = colors[i], label = learner))
+        patches.append(Patch(color = colors[i % len(colors)], label = learner))
     pl.legend(handles = patches, bbox_to_anchor = (-.80, 2.53), \
                loc = 'upper center', borderaxespad = 0., ncol = 3, fontsize = 'x-large')
     
     # Aesthetics
-    pl.suptitle("Performance Metrics for Three Supervised Learning Models", fontsize = 16, y = 1.10)
+    pl.suptitle("Performance Metrics for the Supervised Learning Models", fontsize = 16, y = 1.10)
+    pl.tight_layout()
+    _show(fig, path)
+
+    if records is not None:
+        phases(records, None if path is None else "{0}_phases{1}".format(*os.path.splitext(path)))
+
+
+def phases(records, path = None):
+    """
+    Visualization code to display the phase records of the learners.
+
+    inputs:
+      - records: the phase records of an instrument.Recorder passed to
+        'train_predict()', or the path of its JSON lines file
+      - path: the file the figure is saved to instead of shown
+    """
+
+    import pandas as pd
+
+    if isinstance(records, str):
+        records = instrument.load_records(records)
+    data = pd.DataFrame(records)
+    learners = list(dict.fromkeys(data['learner']))
+    sizes = sorted(data['sample_size'].unique())
+
+    # (phase, record field, scale, y-label, title) of every panel
+    panels = [
+        ('fit', 'wall_ns', 1e-9, "Time (in seconds)", "Fit Wall Time"),
+        ('fit', 'cpu_ns', 1e-9, "Time (in seconds)", "Fit CPU Time"),
+        ('fit', 'tracemalloc_peak_bytes', 1e-6, "Memory (in MB)", "Fit Peak Allocations"),
+        ('subset', 'wall_ns', 1e-9, "Time (in seconds)", "Training Subset Copy"),
+        ('predict_test', 'latency_ns', 1e-3, "Latency (in microseconds)", "Testing Set Latency per Row"),
+        ('predict_train', 'wall_ns', 1e-9, "Time (in seconds)", "Predicting Training Subset"),
+    ]
+
+    # Create figure
+    pl = pyplot()
+    from matplotlib.patches import Patch
+    fig, ax = pl.subplots(2, 3, figsize = (11,7))
+    bar_width = 0.9 / max(3, len(learners))
+    colors = COLORS
+
+    for j, (phase, field, scale, ylabel, title) in enumerate(panels):
+        axis = ax[j//3, j%3]
+        if field in data:
+            for k, learner in enumerate(learners):
+                rows = data[(data['phase'] == phase) & (data['learner'] == learner)]
+                values = rows.groupby('sample_size')[field].mean().reindex(sizes) * scale
+                axis.bar(np.arange(len(sizes)) + k*bar_width, values, width = bar_width,
+                         color = colors[k % len(colors)])
+        axis.set_xticks(np.arange(len(sizes)) + bar_width*(len(learners) - 1)/2.)
+        axis.set_xticklabels(sizes)
+        axis.set_xlabel("Training Set Size")
+        axis.set_ylabel(ylabel)
+        axis.set_title(title)
+
+    # Create patches for the legend
+    patches = [Patch(color = colors[k % len(colors)], label = learner)
+               for k, learner in enumerate(learners)]
+    pl.legend(handles = patches, bbox_to_anchor = (-.80, 2.53), \
+               loc = 'upper center', borderaxespad = 0., ncol = 3, fontsize = 'x-large')
+
+    # Aesthetics
+    pl.suptitle("Training and Prediction Phases of the Supervised Learning Models", fontsize = 16, y = 1.10)
     pl.tight_layout()
-    pl.show()
+    _show(fig, path)
     
 
-def feature_plot(importances, X_train, y_train):
+def feature_plot(importances, X_train, y_train, path = None):
+    """
+    Visualization code for displaying the five most important features.
+    'X_train' is either the training DataFrame or the list of its column names.
+    The figure is saved to 'path' instead of shown if given.
+    """
     
     # Display the five most important features
     indices = np.argsort(importances)[::-1]
-    columns = X_train.columns.values[indices[:5]]
+    names = X_train.columns.values if hasattr(X_train, 'columns') else np.asarray(X_train)
+    columns = names[indices[:5]]
     values = importances[indices][:5]
 
     # Creat the plot
+    pl = pyplot()
     fig = pl.figure(figsize = (9,5))
     pl.title("Normalized Weights for First Five Most Predictive Features", fontsize = 16)
     pl.bar(np.arange(5), values, width = 0.6, align="center", color = '#00A000', \
@@ -140,4 +263,4 @@ def feature_plot(importances, X_train, y_train):
     
     pl.legend(loc = 'upper center')
     pl.tight_layout()
-    pl.show()  
+    _show(fig, path)  